@@ -1,27 +1,960 @@
 #!/usr/bin/env python3
 
 import argparse
+import sys
 import logging
 import pathlib
 import os
 import json
-import re, datetime
-import shutil
-import platform
-import unittest
+import errno
+import bisect
+import contextlib
+import collections
+import fnmatch
+import threading
+import time
 
 
 
+# file names are case insensitive on windows
+CASE_INSENSITIVE = os.name == 'nt'
+
+
 def os_case(in_str):
-    sys = platform.system()
-    if sys.lower() == 'windows':
+    if CASE_INSENSITIVE:
         in_str = in_str.lower()
     return in_str
 
 
+# a file found by walk_files. path is the full path, relative_path is relative to the walked root (always with '/' separators)
+file_record = collections.namedtuple('file_record', ['path', 'relative_path', 'name', 'is_symlink'])
+
+
+class path_filter():
+    '''
+    include / exclude glob patterns, matched against paths relative to the taken over directory ('/' separated).
+    a pattern without a '/' matches a name at any depth (eg: "*.conf", ".git"), a pattern with a '/' matches 
+    the relative path from the root (eg: "cache/*.tmp", or "/build" for build in the root only). a pattern ending with '/' matches directories only.
+    excluded directories are pruned: nothing under them is visited. if there are include patterns, only files matching one of them are taken.
+    the patterns can also be written in a .takeoverignore file in the root of the directory: one exclude pattern per line, 
+    include patterns start with '!', and lines starting with '#' are comments
+    '''
+    IGNORE_FILE = '.takeoverignore'
+
+    def __init__(self, include = None, exclude = None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self._include_files, _ = self._compile(self.include)
+        self._exclude_files, self._exclude_dirs = self._compile(self.exclude)
+
+
+    @staticmethod
+    def _compile(patterns):
+        '''return (regex for files, regex for directories) matching any of the patterns, or None if there are no patterns'''
+        if not patterns:
+            return None, None
+        import re
+        file_patterns = list()
+        dir_patterns = list()
+        for pattern in patterns:
+            dir_only = pattern.endswith('/')
+            anchored = pattern.startswith('/')
+            pattern = pattern.rstrip('/')
+            if anchored:
+                pattern = pattern[1:]
+            if not pattern:
+                continue
+            regex = fnmatch.translate(pattern)
+            if '/' not in pattern and not anchored:
+                regex = '(?:.*/)?' + regex
+            dir_patterns.append(regex)
+            if not dir_only:
+                file_patterns.append(regex)
+        flags = re.IGNORECASE if CASE_INSENSITIVE else 0
+        compile_patterns = lambda p: re.compile('|'.join(p), flags) if p else None
+        return compile_patterns(file_patterns), compile_patterns(dir_patterns)
+
+
+    @classmethod
+    def load(cls, root, include = None, exclude = None):
+        '''return a path_filter with the given patterns and the patterns of the ignore file in 'root' (if there is one)'''
+        include = list(include or [])
+        exclude = list(exclude or [])
+        ignore_file = os.path.join(str(root), cls.IGNORE_FILE)
+        if os.path.isfile(ignore_file):
+            with open(ignore_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    if line.startswith('!'):
+                        include.append(line[1:])
+                    else:
+                        exclude.append(line)
+        return cls(include, exclude)
+
+
+    def __bool__(self):
+        return len(self.include) > 0 or len(self.exclude) > 0
+
+
+    def dir_excluded(self, relative_path):
+        return self._exclude_dirs is not None and self._exclude_dirs.match(relative_path) is not None
+
+
+    def file_included(self, relative_path):
+        if self._exclude_files is not None and self._exclude_files.match(relative_path):
+            return False
+        return self._include_files is None or self._include_files.match(relative_path) is not None
+
+
+def walk_files(root, suffixes = None, path_filter = None, relative_root = ''):
+    '''
+    yield a file_record for every file under the directory 'root', like os.walk but with a single os.scandir call per directory.
+    the file type comes from the cached directory entry, so no extra stat is needed per file. 
+    symlinks to directories are not followed (and not returned), symlinks to files and broken symlinks are returned.
+    suffixes - if not None, only files with these suffixes (os_case-d, with a leading '.') are returned
+    path_filter - if not None, a path_filter. excluded directories are not visited, and only included files are returned
+    relative_root - the relative path of 'root' itself, when it is a sub directory of the walked tree (ends with '/')
+    '''
+    if suffixes is not None:
+        suffixes = frozenset(suffixes)
+    root = str(root)
+    stack = [(root, relative_root)]
+    while stack:
+        dir_path, relative_dir = stack.pop()
+        try:
+            entries = os.scandir(dir_path)
+        except OSError:
+            logging.error('couldnt read directory {}'.format(dir_path))
+            continue
+        with entries:
+            for entry in entries:
+                relative_path = relative_dir + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink() and (path_filter is None or not path_filter.dir_excluded(relative_path)):
+                        stack.append((entry.path, relative_path + '/'))
+                elif (suffixes is None or os_case(os.path.splitext(entry.name)[1]) in suffixes) and \
+                        (path_filter is None or path_filter.file_included(relative_path)):
+                    yield file_record(entry.path, relative_path, entry.name, entry.is_symlink())
+
+
+def file_hash(file_path):
+    '''return the sha256 hex digest of the file content'''
+    import hashlib
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(file_path, text):
+    '''write text to file_path through a temporary file in the same directory, which is synced to disk and renamed over file_path.
+    after a crash file_path holds either the old content or the new one, never a partial write'''
+    import tempfile
+    file_path = str(file_path)
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix = '.' + os.path.basename(file_path) + '.', dir = dir_path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, os.stat(file_path).st_mode if os.path.exists(file_path) else 0o644)
+        os.replace(temp_path, file_path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # make the rename itself durable
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+# linux ioctl request for a copy on write clone of a whole file (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def _reflink(src_fd, dest_fd, size):
+    import fcntl
+    fcntl.ioctl(dest_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dest_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dest_fd, size - copied)
+        if sent == 0:
+            raise OSError(errno.EIO, 'copy_file_range stopped after {} of {} bytes'.format(copied, size))
+        copied += sent
+
+
+def _sendfile(src_fd, dest_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dest_fd, src_fd, None, size - copied)
+        if sent == 0:
+            raise OSError(errno.EIO, 'sendfile stopped after {} of {} bytes'.format(copied, size))
+        copied += sent
+
+
+# copy strategies, fastest first. a strategy that is not supported by the platform or the file system raises an error
+COPY_STRATEGIES = [('reflink', _reflink), ('copy_file_range', _copy_file_range), ('sendfile', _sendfile)]
+
+
+def fast_copy(src, dest):
+    '''
+    copy the content and metadata of file src to the file dest, like shutil.copy2.
+    a copy on write clone is tried first, then a copy inside the kernel, and a regular copy is used if both are not supported.
+    return the name of the strategy used: "reflink", "copy_file_range", "sendfile" or "copy"
+    '''
+    import shutil
+    strategy = 'copy'
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        for name, copy_content in COPY_STRATEGIES:
+            try:
+                copy_content(fsrc.fileno(), fdest.fileno(), size)
+                if os.fstat(fdest.fileno()).st_size != size:
+                    raise OSError(errno.EIO, '{} copied a partial file'.format(name))
+                strategy = name
+                break
+            except (OSError, AttributeError, ImportError):
+                # not supported here. start over with the next strategy
+                os.lseek(fsrc.fileno(), 0, os.SEEK_SET)
+                os.lseek(fdest.fileno(), 0, os.SEEK_SET)
+                os.ftruncate(fdest.fileno(), 0)
+        if strategy == 'copy':
+            shutil.copyfileobj(fsrc, fdest)
+    shutil.copystat(src, dest)
+    logging.debug('copied {} to {} ({})'.format(src, dest, strategy))
+    return strategy
+
+
+class name_index():
+    '''short name -> database ids of the items with that name. the names are also kept sorted for prefix lookups'''
+
+    def __init__(self, ids = ()):
+        self._ids = dict()
+        self._sorted_names = list()
+        for id in ids:
+            self.add(id)
+
+
+    def add(self, id):
+        name = id.split('_', maxsplit = 1)[1]
+        ids = self._ids.get(name)
+        if ids is None:
+            ids = self._ids[name] = list()
+            bisect.insort(self._sorted_names, name)
+        ids.append(id)
+
+
+    def remove(self, id):
+        name = id.split('_', maxsplit = 1)[1]
+        ids = self._ids.get(name, [])
+        if id in ids:
+            ids.remove(id)
+        if len(ids) == 0 and name in self._ids:
+            self._ids.pop(name)
+            self._sorted_names.pop(bisect.bisect_left(self._sorted_names, name))
+
+
+    def ids(self, name):
+        return list(self._ids.get(name, []))
+
+
+    def _ids_for_names(self, names):
+        return [id for name in names for id in self._ids[name]]
+
+
+    def prefix(self, prefix):
+        '''return the ids of all items whose name starts with prefix'''
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        names = list()
+        for name in self._sorted_names[start:]:
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+        return self._ids_for_names(names)
+
+
+    def glob(self, pattern):
+        '''return the ids of all items whose name matches the glob pattern'''
+        return self._ids_for_names(fnmatch.filter(self._sorted_names, pattern))
+
+
+class json_backend():
+    '''
+    keeps the whole database in takeover_db.json (see sources_db for the format).
+    the file is read once, and rewritten on every change
+    '''
+    file_name = 'takeover_db.json'
+
+    def __init__(self, db_folder_path):
+        self._db_dict = None
+        self._names = name_index()
+        self._db_file = pathlib.Path(db_folder_path) / self.file_name
+        # while a batch is open, changes are kept in memory and the snapshot is used for rollback
+        self._batch_snapshot = None
+        self._batch_changed = False
+        # modification time of the file when it was last read or written (see refresh)
+        self._mtime = None
+
+
+    def exists(self):
+        return self._db_file.exists()
+
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self._db_file).st_mtime_ns
+        except OSError:
+            return None
+
+
+    def refresh(self):
+        '''forget the loaded database if the file was changed by another process since it was read'''
+        if self._db_dict is not None and self._batch_snapshot is None and self._file_mtime() != self._mtime:
+            self._db_dict = None
+
+
+    def begin(self):
+        self._batch_snapshot = dict(self._db_dict)
+        self._batch_changed = False
+
+
+    def commit(self):
+        # the snapshot is kept for rollback until the changes are written
+        committed = not self._batch_changed or self.save()
+        if committed:
+            self._batch_snapshot = None
+        return committed
+
+
+    def rollback(self):
+        if self._batch_snapshot is not None:
+            self._db_dict = self._batch_snapshot
+            self._batch_snapshot = None
+            self._build_index()
+
+
+    def load(self):
+        db_loaded = False
+        if self._db_dict is not None:
+            db_loaded = True
+        else:
+            if self._db_file.exists():
+                try:
+                    db_file = None
+                    db_file = open(self._db_file, 'r')
+                    if db_file:
+                        try:
+                            self._mtime = self._file_mtime()
+                            self._db_dict = json.load(db_file)
+                            if isinstance(self._db_dict, dict):
+                                db_loaded = True
+                                self._build_index()
+                            else:
+                                logging.error('database load error - database is corrupted')
+                        except:
+                            self._db_dict = None
+                            logging.error('database load error - invalid database file format')
+                    db_file.close()
+                except: 
+                    logging.fatal('database load error - couldnt open database file')
+                finally:
+                    pass
+            else:
+                logging.error('database load error - database file doesnt exist')
+        return db_loaded
+
+
+    def create(self):
+        db_created = False
+        db_file = None
+
+        if not self._db_file.exists():
+            try:
+                db_file = open(self._db_file, 'w')
+                if self._db_dict is not None:
+                    logging.critical('database create conflict - database file doesnt exist but some data is loaded. You should seek professional help')
+                else:
+                    empty_db_data = {}
+                    json.dump(empty_db_data, db_file)
+                    db_created = True
+                db_file.close()
+            except: 
+                logging.fatal('database create error - couldnt create database file {}'.format(self._db_file))
+            finally:
+                pass
+        else:
+            logging.debug('database create error - database file already exist')
+
+        return db_created
+
+
+    def save(self):
+        db_saved = False
+        db_file = None
+
+        try:
+            # validate the database object before writing
+            json_str = json.dumps(self._db_dict)
+            if not isinstance(json_str, str):
+                raise
+    
+            try:
+                # write the database object to file
+                atomic_write(self._db_file, json_str)
+                self._mtime = self._file_mtime()
+                db_saved = True
+            except:
+                logging.fatal('database save error - couldnt write database file')
+    
+        except:
+            logging.error('database save validation error - invalid database format')
+            logging.debug('database object structure: {}'.format(self._db_dict))
+
+        return db_saved
+
+
+    def _build_index(self):
+        self._names = name_index(self._db_dict)
+
+
+    def get(self, id):
+        return self._db_dict.get(id)
+
+
+    def ids_for_name(self, name):
+        return self._names.ids(name)
+
+
+    def find_prefix(self, prefix):
+        '''return the entries of all items whose name starts with prefix'''
+        return [self._db_dict[id] for id in self._names.prefix(prefix)]
+
+
+    def find_glob(self, pattern):
+        '''return the entries of all items whose name matches the glob pattern'''
+        return [self._db_dict[id] for id in self._names.glob(pattern)]
+
+
+    def entries(self):
+        return list(self._db_dict.values())
+
+
+    def put(self, entry):
+        '''add or replace an entry and save the database'''
+        id = entry['database id']
+        is_new = id not in self._db_dict
+        old_entry = self._db_dict.get(id)
+        self._db_dict[id] = entry
+        self._batch_changed = True
+        saved = self._batch_snapshot is not None or self.save()
+        if not saved:
+            if is_new:
+                self._db_dict.pop(id)
+            else:
+                self._db_dict[id] = old_entry
+        elif is_new:
+            self._names.add(id)
+        return saved
+
+
+    def delete(self, id):
+        '''remove an entry and save the database'''
+        entry = self._db_dict.pop(id)
+        self._batch_changed = True
+        saved = self._batch_snapshot is not None or self.save()
+        if saved:
+            self._names.remove(id)
+        else:
+            self._db_dict[id] = entry
+        return saved
+
+
+    def import_entries(self, entries):
+        '''add all entries with a single save'''
+        for entry in entries:
+            self._db_dict[entry['database id']] = entry
+        self._batch_changed = True
+        saved = self._batch_snapshot is not None or self.save()
+        self._build_index()
+        return saved
+
+
+    def retire(self):
+        '''keep the database file aside after it was migrated to another backend'''
+        self._db_file.rename(self._db_file.with_name(self.file_name + '.migrated'))
+
+
+class sqlite_backend():
+    '''
+    keeps the database in takeover_db.sqlite. every item is a row holding its json entry (see sources_db),
+    with indexed columns for the id, the name and the paths, so lookups and single item changes dont touch other items.
+    name patterns use sqlite GLOB matching
+    '''
+    file_name = 'takeover_db.sqlite'
+    # rows read at a time by entries()
+    fetch_size = 500
+
+    def __init__(self, db_folder_path):
+        self._db_file = pathlib.Path(db_folder_path) / self.file_name
+        self._connection = None
+        self._lock = threading.RLock()
+        self._in_batch = False
+
+
+    def exists(self):
+        return self._db_file.exists()
+
+
+    def begin(self):
+        self._in_batch = True
+
+
+    def commit(self):
+        self._in_batch = False
+        return self.save()
+
+
+    def rollback(self):
+        self._in_batch = False
+        with self._lock:
+            self._connection.rollback()
+
+
+    def refresh(self):
+        # sqlite reads the changes of other processes by itself
+        pass
+
+
+    def _connect(self):
+        import sqlite3
+        self._connection = sqlite3.connect(str(self._db_file), check_same_thread = False)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                original_path TEXT,
+                symlink_path TEXT,
+                entry TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS items_name ON items (name);
+            CREATE INDEX IF NOT EXISTS items_original_path ON items (original_path);
+            CREATE INDEX IF NOT EXISTS items_symlink_path ON items (symlink_path);
+        ''')
+        self._connection.commit()
+
+
+    def load(self):
+        db_loaded = False
+        if self._connection is not None:
+            db_loaded = True
+        elif self._db_file.exists():
+            try:
+                self._connect()
+                db_loaded = True
+            except:
+                self._connection = None
+                logging.fatal('database load error - couldnt open database file {}'.format(self._db_file))
+        else:
+            logging.error('database load error - database file doesnt exist')
+        return db_loaded
+
+
+    def create(self):
+        db_created = False
+        if not self._db_file.exists():
+            try:
+                self._connect()
+                db_created = True
+            except:
+                logging.fatal('database create error - couldnt create database file {}'.format(self._db_file))
+        else:
+            logging.debug('database create error - database file already exist')
+        return db_created
+
+
+    def save(self):
+        db_saved = False
+        with self._lock:
+            try:
+                self._connection.commit()
+                db_saved = True
+            except:
+                logging.fatal('database save error - couldnt commit to {}'.format(self._db_file))
+        return db_saved
+
+
+    def _select_entries(self, where, params):
+        return list(self._iter_entries(where, params))
+
+
+    def _iter_entries(self, where, params):
+        '''yield the entries of the selected rows, fetch_size rows at a time. the lock is held only while fetching, on a cursor of its own'''
+        with self._lock:
+            cursor = self._connection.execute('SELECT entry FROM items ' + where, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield json.loads(r[0])
+        finally:
+            cursor.close()
+
+
+    def get(self, id):
+        entries = self._select_entries('WHERE id = ?', (id,))
+        return entries[0] if entries else None
+
+
+    def ids_for_name(self, name):
+        with self._lock:
+            rows = self._connection.execute('SELECT id FROM items WHERE name = ? ORDER BY id', (name,)).fetchall()
+        return [r[0] for r in rows]
+
+
+    def find_prefix(self, prefix):
+        '''return the entries of all items whose name starts with prefix'''
+        import re
+        return self.find_glob(re.sub(r'([\[\]*?])', r'[\1]', prefix) + '*')
+
+
+    def find_glob(self, pattern):
+        '''return the entries of all items whose name matches the glob pattern'''
+        return self._select_entries('WHERE name GLOB ? ORDER BY name, id', (pattern,))
+
+
+    def entries(self):
+        return self._iter_entries('ORDER BY id', ())
+
+
+    def _row(self, entry):
+        id = entry['database id']
+        return (id, id.split('_', maxsplit = 1)[1], entry['original path'], entry['symlink path'], json.dumps(entry))
+
+
+    def put(self, entry):
+        '''add or replace an entry and commit it'''
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', self._row(entry))
+            return self._in_batch or self.save()
+
+
+    def delete(self, id):
+        '''remove an entry and commit it'''
+        with self._lock:
+            self._connection.execute('DELETE FROM items WHERE id = ?', (id,))
+            return self._in_batch or self.save()
+
+
+    def import_entries(self, entries):
+        '''add all entries in a single transaction'''
+        with self._lock:
+            self._connection.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', [self._row(e) for e in entries])
+            return self._in_batch or self.save()
+
+
+    def retire(self):
+        self._connection.close()
+        self._connection = None
+        self._db_file.rename(self._db_file.with_name(self.file_name + '.migrated'))
+
+
+class sharded_backend():
+    '''
+    keeps every entry in its own file, <database id>.entry.json in the database folder (next to the item manifest), 
+    and the names of the items in a small index file, takeover_index.json: {database id : name}.
+    a command on a single item reads the index and the entry of that item only, and changing an item writes only its entry file.
+    adding or removing items rewrites the index under a lock, merged with the items other processes added or removed since it was read
+    '''
+    file_name = 'takeover_index.json'
+    ENTRY_SUFFIX = '.entry.json'
+    LOCK_NAME = 'takeover_index.lock'
+
+    def __init__(self, db_folder_path):
+        self._db_folder_path = pathlib.Path(db_folder_path)
+        self._db_file = self._db_folder_path / self.file_name
+        # database id -> name, as read from the index file
+        self._index = None
+        self._names = name_index()
+        # entries read or written so far, by database id
+        self._entries = dict()
+        self._lock = threading.RLock()
+        # while a batch is open, changed entries are kept in memory (None for a removed entry), and the snapshot is used for rollback
+        self._pending = None
+        self._batch_snapshot = None
+        # modification time of the index when it was last read or written (see refresh)
+        self._mtime = None
+
+
+    def exists(self):
+        return self._db_file.exists()
+
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self._db_file).st_mtime_ns
+        except OSError:
+            return None
+
+
+    def _entry_file(self, id):
+        return self._db_folder_path / (id + self.ENTRY_SUFFIX)
+
+
+    def refresh(self):
+        '''forget the entries read so far (other processes change them without the index), and the index if another process changed it'''
+        with self._lock:
+            if self._pending is None:
+                self._entries = dict()
+                if self._index is not None and self._file_mtime() != self._mtime:
+                    self._index = None
+
+
+    def _set_index(self, index):
+        self._index = index
+        self._names = name_index(index)
+
+
+    def _read_index(self):
+        with open(self._db_file, 'r') as f:
+            index = json.load(f)
+        if not isinstance(index, dict):
+            raise ValueError('index is not a dict')
+        return index
+
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        '''hold an exclusive lock on the index, between processes where fcntl is available'''
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        with open(self._db_folder_path / self.LOCK_NAME, 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+
+    def _write_index(self, added, removed):
+        '''add the 'added' ids ({database id : name}) to the index file and remove the 'removed' ids, keeping the changes of other processes'''
+        index_saved = False
+        try:
+            with self._index_lock():
+                index = self._read_index()
+                index.update(added)
+                for id in removed:
+                    index.pop(id, None)
+                atomic_write(self._db_file, json.dumps(index))
+                self._mtime = self._file_mtime()
+                self._set_index(index)
+                index_saved = True
+        except:
+            logging.fatal('database save error - couldnt write index file {}'.format(self._db_file))
+        return index_saved
+
+
+    def _write_entry(self, entry):
+        atomic_write(self._entry_file(entry['database id']), json.dumps(entry))
+
+
+    def begin(self):
+        self._pending = dict()
+        self._batch_snapshot = (dict(self._index), dict(self._entries))
+
+
+    def commit(self):
+        # the snapshot is kept for rollback until the changes are written
+        index, _ = self._batch_snapshot
+        committed = self._write(self._pending, index)
+        if committed:
+            self._pending = None
+            self._batch_snapshot = None
+        return committed
+
+
+    def rollback(self):
+        if self._batch_snapshot is not None:
+            index, self._entries = self._batch_snapshot
+            self._set_index(index)
+            self._pending = None
+            self._batch_snapshot = None
+
+
+    def _write(self, changes, index):
+        '''write the changed entries ({database id : entry, or None if removed}). index is the index before the changes'''
+        db_saved = False
+        added = {id : entry['name'] for id, entry in changes.items() if entry is not None and id not in index}
+        removed = [id for id, entry in changes.items() if entry is None and id in index]
+        try:
+            # an entry file is written before it is in the index, and leaves the index before it is removed
+            for entry in changes.values():
+                if entry is not None:
+                    self._write_entry(entry)
+            if (added or removed) and not self._write_index(added, removed):
+                return db_saved
+            for id, entry in changes.items():
+                if entry is None and self._entry_file(id).exists():
+                    self._entry_file(id).unlink()
+            db_saved = True
+        except:
+            logging.fatal('database save error - couldnt write the entry files')
+        return db_saved
+
+
+    def load(self):
+        db_loaded = False
+        with self._lock:
+            if self._index is not None:
+                db_loaded = True
+            elif self._db_file.exists():
+                try:
+                    self._mtime = self._file_mtime()
+                    self._set_index(self._read_index())
+                    db_loaded = True
+                except:
+                    logging.error('database load error - invalid index file {}'.format(self._db_file))
+            else:
+                logging.error('database load error - database file doesnt exist')
+        return db_loaded
+
+
+    def create(self):
+        db_created = False
+        if not self._db_file.exists():
+            try:
+                atomic_write(self._db_file, json.dumps(dict()))
+                db_created = True
+            except:
+                logging.fatal('database create error - couldnt create database file {}'.format(self._db_file))
+        else:
+            logging.debug('database create error - database file already exist')
+        return db_created
+
+
+    def save(self):
+        # every change is written when it is made, or when the batch is commited
+        return True
+
+
+    def get(self, id):
+        with self._lock:
+            if id not in self._index:
+                return None
+            entry = self._entries.get(id)
+            if entry is None:
+                try:
+                    with open(self._entry_file(id), 'r') as f:
+                        entry = self._entries[id] = json.load(f)
+                except:
+                    logging.error('database load error - couldnt read entry file {}'.format(self._entry_file(id)))
+            return entry
+
+
+    def ids_for_name(self, name):
+        return self._names.ids(name)
+
+
+    def _get_all(self, ids):
+        return [e for e in [self.get(id) for id in ids] if e is not None]
+
+
+    def find_prefix(self, prefix):
+        '''return the entries of all items whose name starts with prefix'''
+        return self._get_all(self._names.prefix(prefix))
+
+
+    def find_glob(self, pattern):
+        '''return the entries of all items whose name matches the glob pattern'''
+        return self._get_all(self._names.glob(pattern))
+
+
+    def entries(self):
+        return self._get_all(sorted(self._index))
+
+
+    def _change(self, changes):
+        '''apply changes ({database id : entry, or None to remove}) in memory, and write them unless a batch is open'''
+        with self._lock:
+            index = dict(self._index)
+            for id, entry in changes.items():
+                if entry is None:
+                    self._entries.pop(id, None)
+                    if self._index.pop(id, None) is not None:
+                        self._names.remove(id)
+                else:
+                    self._entries[id] = entry
+                    if id not in self._index:
+                        self._index[id] = entry['name']
+                        self._names.add(id)
+            if self._pending is not None:
+                self._pending.update(changes)
+                return True
+            saved = self._write(changes, index)
+            if not saved:
+                self._set_index(index)
+                for id in changes:
+                    self._entries.pop(id, None)
+            return saved
+
+
+    def put(self, entry):
+        '''add or replace an entry and write its file'''
+        return self._change({entry['database id'] : entry})
+
+
+    def delete(self, id):
+        '''remove an entry from the index and remove its file'''
+        return self._change({id : None})
+
+
+    def import_entries(self, entries):
+        '''add all entries with a single index write'''
+        return self._change({entry['database id'] : entry for entry in entries})
+
+
+    def retire(self):
+        '''keep the index aside after the database was migrated to another backend. the entry files are kept with it'''
+        self._db_file.rename(self._db_file.with_name(self.file_name + '.migrated'))
+
+
+# all database backends by name. the first existing database file (in this order) selects the backend
+backends = {'sqlite' : sqlite_backend, 'sharded' : sharded_backend, 'json' : json_backend}
+
+
+def open_backend(db_folder_path, backend_name = None):
+    '''return the backend of the database in db_folder_path. if backend_name is None, the backend is selected by the existing database file'''
+    if backend_name is None:
+        backend_name = 'json'
+        for name, backend in backends.items():
+            if (pathlib.Path(db_folder_path) / backend.file_name).exists():
+                backend_name = name
+                break
+    return backends[backend_name](db_folder_path)
+
+
 class sources_db():
     '''
-    data base file is a json that looks like this:
+    the database keeps an entry for every managed item. the entries are stored by a backend (see json_backend, sqlite_backend and sharded_backend).
+    by default the data base file is a json that looks like this:
     {
         database id : {
             "name" : string,
@@ -29,6 +962,12 @@ class sources_db():
             "original path" : a string representin a path to file or folder,
             "default database path" : a string representin a path to database folder (when creating links they will point to the item under this location),
             "symlink path" : a string representin a path where the symlink is (or should be) located. by default it is equal to "original path"
+            "extensions" : list of the suffixes taken over, or null for all files
+            "deduplicated" : true if the item files are hardlinks to the blobs folder (see blob_store). missing means false
+            "relative links" : true if links point to the database folder with a path relative to the link, instead of "default database path". missing means false
+            "directory links" : true if directories are linked to the database as a whole, where possible. missing means false
+            "include" : list of glob patterns of the files taken over (see path_filter). missing or null for all files
+            "exclude" : list of glob patterns of files and directories that are not taken over. missing or null for none
         },
     }
 
@@ -52,68 +991,35 @@ class sources_db():
             }
     }
     '''
+    # database folder -> backend kept in memory by a resident_server
+    resident_backends = dict()
 
     def __init__(self, db_path = None):        
-        self._db_dict = None
         if db_path is None:
             cwd = pathlib.Path(os.getcwd())
         else:
             cwd = pathlib.Path(db_path)
         self._db_folder_path = cwd
-        self._db_file = cwd / 'takeover_db.json'
+        # a running server (see resident_server) keeps its backend loaded for all the commands
+        self._backend = sources_db.resident_backends.get(str(cwd)) or open_backend(cwd)
+        # open batch nesting level, and what to do when the batch is commited or rolled back
+        self._batch_depth = 0
+        self._on_commit = list()
+        self._on_rollback = list()
+        # items may be added from several threads (see take_over)
+        self._lock = threading.RLock()
+        self._new_ids = set()
 
 
     def load(self):
-        db_loaded = False
-        if self._db_dict is not None:
-            db_loaded = True
-        else:
-            if self._db_file.exists():
-                try:
-                    db_file = None
-                    db_file = open(self._db_file, 'r')
-                    if db_file:
-                        try:
-                            self._db_dict = json.load(db_file)
-                            if isinstance(self._db_dict, dict):
-                                db_loaded = True
-                            else:
-                                logging.error('database load error - database is corrupted')
-                        except:
-                            self._db_dict = None
-                            logging.error('database load error - invalid database file format')
-                    db_file.close()
-                except: 
-                    logging.fatal('database load error - couldnt open database file')
-                finally:
-                    pass
-            else:
-                logging.error('database load error - database file doesnt exist')
-        return db_loaded
+        return self._backend.load()
 
 
-    def create(self):
-        db_created = False
-        db_file = None
-
-        if not self._db_file.exists():
-            try:
-                db_file = open(self._db_file, 'w')
-                if self._db_dict is not None:
-                    logging.critical('database create conflict - database file doesnt exist but some data is loaded. You should seek professional help')
-                else:
-                    empty_db_data = {}
-                    json.dump(empty_db_data, db_file)
-                    db_created = True
-                db_file.close()
-            except: 
-                logging.fatal('database create error - couldnt create database file {}'.format(self._db_file))
-            finally:
-                pass
-        else:
-            logging.debug('database create error - database file already exist')
-
-        return db_created
+    def create(self, backend_name = None):
+        '''create an empty database. backend_name is one of 'backends' (json by default). nothing happens if a database already exists'''
+        if backend_name is not None and not self._backend.exists():
+            self._backend = open_backend(self._db_folder_path, backend_name)
+        return self._backend.create()
 
 
     def create_or_load(self):
@@ -121,24 +1027,87 @@ class sources_db():
         return self.load()
 
 
+    def migrate(self, backend_name):
+        '''copy all entries to a new database using backend_name, and keep the current database file aside'''
+        migrated = False
+        target = open_backend(self._db_folder_path, backend_name)
+        if isinstance(self._backend, type(target)):
+            logging.error('database is already using {}'.format(backend_name))
+        elif target.exists():
+            logging.error('couldnt migrate. database file {} already exist'.format(target.file_name))
+        elif self.load() and target.create() and target.load():
+            if target.import_entries(self._backend.entries()):
+                self._backend.retire()
+                self._backend = target
+                migrated = True
+        return migrated
+
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        group database changes, so they are written once when the batch ends. eg:
+            with db.batch():
+                db.remove_item('a', False)
+                db.remove_item('b', False)
+        removed items storage is deleted only after the changes are written. 
+        if the batch fails (an exception, or the database could not be written) all changes are rolled back:
+        removed items are kept, and added items are restored to their original location and removed from storage.
+        nested batches are part of the outer batch
+        '''
+        if self._batch_depth == 0:
+            if not self.load():
+                raise RuntimeError('couldnt load the database')
+            self._backend.begin()
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._end_batch(False)
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._end_batch(True)
+
+
+    def on_batch_end(self, action):
+        '''call action when the current batch ends (commited or rolled back), or now if there is no batch'''
+        if self._batch_depth > 0:
+            self._on_commit.append(action)
+            self._on_rollback.append(action)
+        else:
+            action()
+
+
+    def _end_batch(self, commit):
+        if commit and self._backend.commit():
+            actions = self._on_commit
+        else:
+            logging.error('database batch failed. rolling back all changes')
+            self._backend.rollback()
+            actions = self._on_rollback
+        self._on_commit = list()
+        self._on_rollback = list()
+        for action in actions:
+            action()
+
+
     def find_item(self, item_name):
         db_entry = None
         error_found = False
         if self.load():
             # try to find exact name
-            db_entry = self._db_dict.get(item_name)
+            db_entry = self._backend.get(item_name)
             if db_entry is None:
-                #try to find with partial name
-                #create a list of tuples with (sort_name, original_name) eg: [('20191030050124_runtime', 'runtime'),]
-                names = [(i.split('_', maxsplit = 1)[1], i) for i in self._db_dict.keys()]
-                for i in names:
-                    if i[0] == item_name:
-                        if db_entry is not None:
-                            logging.error('yuuuups, item name {} found more than once. dont kow what to do...'.format(item_name))
-                            error_found = True
-                            break
-                        else:
-                            db_entry = self._db_dict[i[1]]
+                #try to find with partial name (the name without the time stamp eg: 'runtime' for '20191030050124_runtime')
+                ids = self._backend.ids_for_name(item_name)
+                if len(ids) > 1:
+                    logging.error('yuuuups, item name {} found more than once. dont kow what to do...'.format(item_name))
+                    error_found = True
+                elif len(ids) == 1:
+                    db_entry = self._backend.get(ids[0])
         if error_found:
             item = None
         elif db_entry is None:
@@ -149,125 +1118,1028 @@ class sources_db():
         return item
 
 
+    def find_items(self, pattern):
+        '''
+        return a list of all items matching 'pattern'. 
+        a pattern without wildcards works like find_item. 'name*' selects all items whose name starts with 'name', 
+        any other glob pattern (eg: 'nginx_?', '*conf*') is matched against all item names
+        '''
+        items = list()
+        if not any([c in pattern for c in '*?[']):
+            item = self.find_item(pattern)
+            if item:
+                items.append(item)
+        elif self.load():
+            prefix = pattern[:-1]
+            if pattern.endswith('*') and not any([c in prefix for c in '*?[']):
+                entries = self._backend.find_prefix(prefix)
+            else:
+                entries = self._backend.find_glob(pattern)
+            items = [db_item(e, self._db_folder_path) for e in entries]
+            if len(items) == 0:
+                logging.error('no item matches {}. may be try something else?'.format(pattern))
+        return items
+
+
     def all_items(self):
         if self.load():
-            for v in self._db_dict.values():
+            for v in self._backend.entries():
                 yield db_item(v, self._db_folder_path)
 
 
     def remove_item(self, item_name, dryrun):
-        '''remove 'item_name' from the database (storage and json file). 
+        '''remove 'item_name' from the database (storage and database file). 
         'item_name' is a string representing an element in the database'''
         removed_ok = True
         if self.load():
             db_item = self.find_item(item_name)
-            if db_item:
+            if db_item and self._batch_depth > 0 and not dryrun:
+                # the files are removed only if the batch is commited
+                removed_ok = self._backend.delete(db_item.get_id())
+                self._on_commit.append(lambda: db_item.delete_from_storage(False))
+            elif db_item:
                 # remove the files
                 if db_item.delete_from_storage(dryrun):
-                    # remove from json
+                    # remove from database
                     id = db_item.get_id()
                     if dryrun:
-                        logging.info('dryrun - item {} removed from json database'.format(id))
+                        logging.info('dryrun - item {} removed from database'.format(id))
                     else:
-                        self._db_dict.pop(id)
-                        removed_ok = self.save()
+                        removed_ok = self._backend.delete(id)
                 else:
                     removed_ok = False
         return removed_ok
 
 
-    def save(self):
-        db_saved = False
-        db_file = None
+    def save(self):
+        return self._backend.save()
+
+
+    def register_entry(self, entry):
+        '''add a new item entry to the database, and record its stored files'''
+        registered = False
+        item = db_item(entry, self._db_folder_path)
+        # hashing the stored files is slow, only the database update needs the lock
+        manifest = item.build_manifest(True)
+        entry = dict(entry, stats = self._updated_stats(entry, manifest, True))
+        with self._lock:
+            if self.load():
+                registered = self._backend.put(entry)
+                if registered and self._batch_depth > 0:
+                    self._on_rollback.append(lambda: item.copy_to_original_location(None, True, False) and item.delete_from_storage(False))
+        if not registered:
+            manifest.remove()
+        return registered
+
+
+    @staticmethod
+    def _updated_stats(entry, manifest, ingested = False):
+        '''return the statistics of the entry, with the stored files counted from the manifest (see record_stats)'''
+        import datetime
+        stats = dict(entry.get('stats') or dict())
+        stats['files'] = len(manifest.files)
+        stats['bytes'] = sum([record[0] for record in manifest.files.values()])
+        now = datetime.datetime.now().isoformat(timespec = 'seconds')
+        if ingested:
+            stats['last ingest'] = now
+        return stats
+
+
+    def record_stats(self, item, ingested = False):
+        '''
+        keep statistics of the item in its database entry, so they are listed without reading any file of the item (see list_sources):
+            "files", "bytes" - number and total size of the stored files, counted from the item manifest
+            "last ingest" - the time files were last taken over (set if ingested is set)
+        link health is kept outside the database (see db_item.record_link_health)
+        '''
+        recorded = False
+        with self._lock:
+            entry = self._backend.get(item.get_id()) if self.load() else None
+            if entry is not None:
+                entry = dict(entry, stats = self._updated_stats(entry, item.load_manifest(), ingested))
+                recorded = self._backend.put(entry)
+                if recorded:
+                    item._db_entry_data = entry
+        return recorded
+
+
+    def _new_id(self, name):
+        '''return a new database id for an item called name'''
+        import re, datetime
+        with self._lock:
+            id = re.sub('[- :.]', '', str(datetime.datetime.now())) + '_' + name
+            while id in self._new_ids:
+                id = re.sub('[- :.]', '', str(datetime.datetime.now())) + '_' + name
+            self._new_ids.add(id)
+        return id
+
+
+    def plan_add_dir(self, plan, dir_path, extensions, database_path_alias = None, move = False, dedup = False, include = None, exclude = None, dir_links = False, relative = False):
+        '''
+        add the operations that copy dir_path (a file or a directory) into the database and register it.
+        include and exclude are glob patterns added to the patterns of the directory's ignore file (see path_filter).
+        dir_links - link whole directories instead of every file. only possible when all files are taken over (no extensions or patterns)
+        relative - links point to the database with a relative path, so the database and the links can be moved together
+        return (item, files) - the new db_item, and the file_records to take over. 
+        if there is nothing to take over, files is empty and nothing is added to the plan
+        '''
+        item = None
+        files = list()
+        name = pathlib.Path(dir_path).name
+        id = self._new_id(name)
+        
+        # load a db if not loaded
+        if self.load():
+            patterns = path_filter.load(dir_path, include, exclude) if os.path.isdir(dir_path) else path_filter(include, exclude)
+            if dir_links and (extensions or patterns):
+                logging.warning('directory links are used only when all the files are taken over. {} will have a link for every file'.format(dir_path))
+                dir_links = False
+            new_entry = {
+                            "name" : name,
+                            "database id" : id,
+                            "is file" : pathlib.Path(dir_path).is_file(),
+                            "original path" : dir_path,
+                            "default database path" : str(self._db_folder_path) if database_path_alias is None else database_path_alias,
+                            "symlink path" : dir_path,
+                            "extensions" : None if extensions is None else ['.' + e.lstrip('.') for e in extensions],
+                            "deduplicated" : dedup,
+                            "directory links" : dir_links,
+                            "relative links" : relative,
+                            "include" : patterns.include or None,
+                            "exclude" : patterns.exclude or None
+                        }
+            item = db_item(new_entry, self._db_folder_path, extensions)
+            files = item._original_files()
+            if len(files) == 0:
+                logging.error('nothing to take over in {}'.format(dir_path))
+            else:
+                # copy filtered files to local storage, and register in db
+                item.plan_ingest(plan, files, move)
+                plan.add('register', entry = new_entry)
+        return item, files
+
+
+    def add_dir(self, dir_path, extensions,  database_path_alias = None, dryrun = False, jobs = 1, move = False, dedup = False, include = None, exclude = None):
+        '''copy dir_path into the database and register it. return (added, item)'''
+        plan = operation_plan(operation_plan.TAKEOVER)
+        item, files = self.plan_add_dir(plan, dir_path, extensions, database_path_alias, move, dedup, include, exclude)
+        added_ok = len(files) > 0 and plan_executor(self, jobs).execute(plan, dryrun)
+        return added_ok, item
+
+
+    def add_file(self, file):
+        pass
+
+
+class copy_engine():
+    '''
+    copies (source file, destination directory) pairs using a bounded pool of worker threads.
+    directories created by the engine are cached, so every destination directory is created only once
+    '''
+
+    def __init__(self, jobs = 1, store = None, on_done = None):
+        '''on_done - if set, called with every (source, destination) pair that was copied or moved'''
+        self._jobs = max(1, jobs or 1)
+        self._store = store
+        self._on_done = on_done
+        self._created_dirs = set()
+        self._dirs_lock = threading.Lock()
+        self.moved = list()
+        # number of copied files by copy strategy (see fast_copy)
+        self.strategies = collections.Counter()
+
+
+    def _make_dir(self, dest):
+        if dest not in self._created_dirs:
+            os.makedirs(dest, exist_ok = True)
+            with self._dirs_lock:
+                self._created_dirs.add(dest)
+
+
+    def _copy_one(self, pair):
+        src = str(pair[0])
+        dest = str(pair[1])
+        copy_ok = True
+        try:
+            #create folder
+            self._make_dir(dest)
+            #copy files
+            if self._store is not None:
+                strategy = self._store.link(src, dest)[2]
+            else:
+                strategy = fast_copy(src, os.path.join(dest, os.path.basename(src)))
+            if strategy is not None:
+                with self._dirs_lock:
+                    self.strategies[strategy] += 1
+            if self._on_done is not None:
+                self._on_done(pair)
+        except:
+            logging.error('copy file {} failed. may be a file with the same directory name already exist'.format(dest))
+            copy_ok = False
+        return copy_ok
+
+
+    def _move_one(self, pair):
+        '''rename the file into the destination directory. when the destination is on another device, copy it instead
+        (the original file is left in place, to be deleted by the caller)'''
+        src = str(pair[0])
+        dest = str(pair[1])
+        move_ok = True
+        try:
+            self._make_dir(dest)
+            if self._store is not None:
+                blob, moved, strategy = self._store.link(src, dest, move = True)
+                if moved:
+                    with self._dirs_lock:
+                        self.moved.append((src, blob))
+            else:
+                moved_to = os.path.join(dest, os.path.basename(src))
+                os.replace(src, moved_to)
+                with self._dirs_lock:
+                    self.moved.append((src, moved_to))
+            if self._on_done is not None:
+                self._on_done(pair)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                move_ok = self._copy_one(pair)
+            else:
+                logging.error('move file {} to {} failed'.format(src, dest))
+                move_ok = False
+        return move_ok
+
+
+    def _run(self, action, src_dest_pairs):
+        import concurrent.futures
+        all_ok = True
+        if self._jobs == 1:
+            for p in src_dest_pairs:
+                if not action(p):
+                    all_ok = False
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self._jobs) as pool:
+                for result in pool.map(action, src_dest_pairs):
+                    if not result:
+                        all_ok = False
+        return all_ok
+
+
+    def _log_dryrun(self, src_dest_pairs, action_name):
+        for src, dest in src_dest_pairs:
+            dest = str(dest)
+            if dest not in self._created_dirs and not os.path.exists(dest):
+                logging.info('dryrun - creating missing directory {}'.format(dest))
+                self._created_dirs.add(dest)
+            logging.info('dryrun - {} file {} to {}'.format(action_name, src, dest))
+
+
+    def copy(self, src_dest_pairs, dryrun):
+        '''copy all pairs. return False if any of the files failed to copy'''
+        copy_ok = True
+        if dryrun:
+            self._log_dryrun(src_dest_pairs, 'copying')
+        else:
+            copy_ok = self._run(self._copy_one, src_dest_pairs)
+            if self.strategies:
+                logging.info('copied {} files ({})'.format(sum(self.strategies.values()), ', '.join(['{}: {}'.format(k, v) for k, v in sorted(self.strategies.items())])))
+        return copy_ok
+
+
+    def move(self, src_dest_pairs, dryrun):
+        '''move all pairs. if any of the files failed to move, all moved files are returned to their place and False is returned'''
+        move_ok = True
+        self.moved = list()
+        if dryrun:
+            self._log_dryrun(src_dest_pairs, 'moving')
+        else:
+            move_ok = self._run(self._move_one, src_dest_pairs)
+            if not move_ok:
+                self.undo_move()
+        return move_ok
+
+
+    def undo_move(self):
+        '''return the files moved by the last call to move() to their original location'''
+        undo_ok = True
+        for src, moved_to in self.moved:
+            try:
+                os.replace(moved_to, src)
+            except OSError:
+                logging.error('could not return moved file {} to {}'.format(moved_to, src))
+                undo_ok = False
+        self.moved = list()
+        return undo_ok
+
+
+class blob_store():
+    '''
+    content addressed storage under the database folder. every file content is stored once in
+    blobs/<first 2 hash chars>/<sha256 of the content>, and items hardlink their files to it.
+    a blob with a single link is no longer used by any item and can be removed.
+    editing an item file through its link changes the blob content, so a blob is checked against its name before it is used again
+    '''
+
+    def __init__(self, database_path):
+        self._root = pathlib.Path(database_path) / 'blobs'
+
+
+    def blob_path(self, digest):
+        return self._root / digest[:2] / digest
+
+
+    def add(self, file_path, move = False):
+        '''store the content of file_path (moving it when possible, if move is set) and return (blob path, moved, copy strategy).
+        the copy strategy is None if the file was not copied (see fast_copy)'''
+        import tempfile
+        file_path = pathlib.Path(file_path)
+        digest = file_hash(file_path)
+        blob = self.blob_path(digest)
+        moved = False
+        strategy = None
+        if blob.exists() and file_hash(blob) != digest:
+            self._file_away(blob)
+        if not blob.exists():
+            blob.parent.mkdir(parents = True, exist_ok = True)
+            if move:
+                try:
+                    os.replace(file_path, blob)
+                    moved = True
+                except OSError:
+                    pass
+            if not moved:
+                # copy to a temporary name first, so a partially copied file is never used as a blob
+                fd, temp_path = tempfile.mkstemp(dir = str(blob.parent))
+                os.close(fd)
+                try:
+                    strategy = fast_copy(file_path, temp_path)
+                    os.replace(temp_path, blob)
+                except:
+                    os.remove(temp_path)
+                    raise
+        return blob, moved, strategy
+
+
+    def _file_away(self, blob):
+        '''a blob that was edited through an item link. keep it under the name of its current content (the items using it keep their links)'''
+        actual = self.blob_path(file_hash(blob))
+        logging.warning('blob {} was changed after it was stored'.format(blob))
+        if actual.exists():
+            blob.unlink()
+        else:
+            actual.parent.mkdir(parents = True, exist_ok = True)
+            os.replace(blob, actual)
+
+
+    def _blob_of(self, file_path, st, digest):
+        '''return the blob that file_path (with the stat result st) is linked to, or None.
+        the blob is looked up by the recorded digest and confirmed by its inode. a file edited through its link may have been filed away
+        under the hash of its current content (see _file_away), that name is tried next'''
+        for find_digest in (lambda: digest, lambda: file_hash(file_path)):
+            d = find_digest()
+            if d is None:
+                continue
+            blob = self.blob_path(d)
+            try:
+                if os.stat(blob).st_ino == st.st_ino:
+                    return blob
+            except OSError:
+                pass
+        return None
+
+
+    def link(self, file_path, dest_dir, move = False):
+        '''store file_path and hardlink it under dest_dir. return (blob path, moved, copy strategy) like add()'''
+        blob, moved, strategy = self.add(file_path, move)
+        os.link(blob, pathlib.Path(dest_dir) / pathlib.Path(file_path).name)
+        return blob, moved, strategy
+
+
+    def release(self, item_dir, manifest, dryrun = False):
+        '''remove item_dir, and every blob that is not used any more once it is removed. manifest is the item_manifest of the item'''
+        import shutil
+        item_dir = pathlib.Path(item_dir)
+        # inode -> [links inside the item, total links, a file linked to it, its stat, its recorded digest]
+        inodes = dict()
+        for f in walk_files(item_dir):
+            if not f.is_symlink:
+                st = os.stat(f.path)
+                record = manifest.files.get(f.relative_path)
+                inodes.setdefault(st.st_ino, [0, st.st_nlink, f.path, st, record[3] if record else None])[0] += 1
+        # a blob whose only other links are inside the item has no other users
+        candidates = list()
+        for count, nlink, file_path, st, digest in inodes.values():
+            if nlink == count + 1:
+                blob = self._blob_of(file_path, st, digest)
+                if blob is not None:
+                    candidates.append(blob)
+        if dryrun:
+            logging.info('dryrun - removing {} and {} unused blobs'.format(item_dir, len(candidates)))
+        else:
+            shutil.rmtree(item_dir)
+            for blob in candidates:
+                try:
+                    if blob.stat().st_nlink == 1:
+                        blob.unlink()
+                except OSError:
+                    logging.error('couldnt remove unused blob {}'.format(blob))
+
+
+class item_manifest():
+    '''
+    list of the files stored for a database item, kept in <database folder>/<database id>.manifest.json:
+    {
+        "files" : {
+            relative path (posix style) : [size, mtime_ns, inode, sha256 of the content],
+        }
+    }
+    size, mtime_ns and inode are of the file in the database. sha256 is null for a file found by a rescan, until it is verified
+    '''
+    # manifest path -> (mtime_ns, files). kept only by a resident_server, so loading an unchanged manifest doesnt parse it again
+    cache = None
+
+    def __init__(self, manifest_path):
+        self._path = pathlib.Path(manifest_path)
+        self.files = dict()
+
+
+    def exists(self):
+        return self._path.exists()
+
+
+    def load(self):
+        loaded = False
+        try:
+            cached = None
+            if item_manifest.cache is not None:
+                mtime = os.stat(self._path).st_mtime_ns
+                cached = item_manifest.cache.get(str(self._path))
+            if cached is not None and cached[0] == mtime:
+                self.files = dict(cached[1])
+            else:
+                with open(self._path, 'r') as f:
+                    self.files = json.load(f)['files']
+                self._cache()
+            loaded = True
+        except:
+            logging.debug('couldnt load manifest {}'.format(self._path))
+        return loaded
+
+
+    def _cache(self):
+        if item_manifest.cache is not None:
+            item_manifest.cache[str(self._path)] = (os.stat(self._path).st_mtime_ns, dict(self.files))
+
+
+    def save(self):
+        saved = False
+        try:
+            atomic_write(self._path, json.dumps({'files' : self.files}))
+            self._cache()
+            saved = True
+        except:
+            logging.error('couldnt save manifest {}'.format(self._path))
+        return saved
+
+
+    def remove(self):
+        if self._path.exists():
+            self._path.unlink()
+        if item_manifest.cache is not None:
+            item_manifest.cache.pop(str(self._path), None)
+
+
+    def add(self, relative_path, file_path, digest = None):
+        '''add or replace the record of file_path (the file in the database). the content is hashed unless digest is given'''
+        st = os.stat(file_path)
+        self.files[relative_path] = [st.st_size, st.st_mtime_ns, st.st_ino, digest or file_hash(file_path)]
+
+
+    def add_unhashed(self, relative_path, file_path, previous = None):
+        '''add or replace the record of file_path without reading its content.
+        the hash of previous (the old record) is kept if the size and modification time are unchanged, otherwise it is null'''
+        st = os.stat(file_path)
+        digest = None
+        if previous is not None and previous[0] == st.st_size and previous[1] == st.st_mtime_ns:
+            digest = previous[3]
+        self.files[relative_path] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+
+
+    def is_unchanged(self, relative_path, st):
+        '''return True if the stat result st matches the recorded size and modification time'''
+        record = self.files.get(relative_path)
+        return record is not None and record[0] == st.st_size and record[1] == st.st_mtime_ns
+
+
+class operation_plan():
+    '''
+    an ordered list of file system (and database) operations. every operation is a dict with an "op" key:
+        {"op" : "mkdir", "path" : directory to create}
+        {"op" : "copy", "src" : file, "dest" : directory to copy the file to, "store" : database folder of the blob_store to store the file in, or null}
+        {"op" : "move", "src" : file, "dest" : directory to move the file to, "store" : same as copy}
+        {"op" : "unlink", "path" : file or link to remove}
+        {"op" : "symlink", "path" : link to create, "target" : where the link points to}
+        {"op" : "register", "entry" : database entry to add (see sources_db)}
+        {"op" : "unregister", "id" : database id of the item to remove, including its storage}
+        {"op" : "rmdir", "path" : empty directory to remove}
+        {"op" : "rmtree", "path" : directory to remove}
+    operations of the same kind are kept together, and the kinds are executed in the order given by 'order'.
+    'rollback' is a list of operations to execute if a critical operation fails (see plan_executor)
+    '''
+    # the operations order used by the commands
+    TAKEOVER = ['mkdir', 'copy', 'move', 'register', 'unlink', 'rmdir', 'symlink']
+    LINKS = ['unlink', 'rmdir', 'mkdir', 'symlink']
+    RESTORE = ['unlink', 'mkdir', 'copy', 'unregister']
+    REMOVE = ['unlink', 'unregister']
+
+    def __init__(self, order):
+        self._order = list(order)
+        self._ops = {k : list() for k in self._order}
+        self.rollback = list()
+
+
+    def add(self, op, **fields):
+        fields['op'] = op
+        self._ops[op].append(fields)
+
+
+    def operations(self):
+        return [o for k in self._order for o in self._ops[k]]
+
+
+    def stages(self):
+        '''return a list of (kind, operations) in execution order'''
+        return [(k, self._ops[k]) for k in self._order if len(self._ops[k]) > 0]
+
+
+    def __len__(self):
+        return sum([len(ops) for ops in self._ops.values()])
+
+
+    @staticmethod
+    def describe(op):
+        '''return a one line description of the operation'''
+        kind = op['op']
+        if kind in ('copy', 'move'):
+            line = '{} {} -> {}'.format(kind, op['src'], op['dest'])
+        elif kind == 'symlink':
+            line = 'symlink {} -> {}'.format(op['path'], op['target'])
+        elif kind == 'register':
+            line = 'register {}'.format(op['entry']['database id'])
+        elif kind == 'unregister':
+            line = 'unregister {}'.format(op['id'])
+        else:
+            line = '{} {}'.format(kind, op['path'])
+        return line
+
+
+    def save(self, plan_path):
+        saved = False
+        try:
+            with open(plan_path, 'w') as f:
+                json.dump({'operations' : self.operations(), 'rollback' : self.rollback}, f, indent = 1)
+            saved = True
+        except:
+            logging.error('couldnt save plan to {}'.format(plan_path))
+        return saved
+
+
+    @classmethod
+    def load(cls, plan_path):
+        '''load a plan written by save(). return None if the file cant be read'''
+        plan = None
+        try:
+            with open(plan_path, 'r') as f:
+                data = json.load(f)
+            order = list()
+            for op in data['operations']:
+                if op['op'] not in order:
+                    order.append(op['op'])
+            plan = cls(order)
+            for op in data['operations']:
+                plan._ops[op['op']].append(op)
+            plan.rollback = data.get('rollback', list())
+        except:
+            logging.error('couldnt load plan from {}'.format(plan_path))
+        return plan
+
+
+class operation_journal():
+    '''
+    an append-only record of a plan execution, kept in the database folder while the plan runs.
+    the first line holds the plan, every following line holds the index of an operation that was completed: {"done" : index}.
+    the journal is removed when the execution ends. a journal that is left behind belongs to an interrupted execution (see the "resume" command).
+    while the execution runs its journal is locked (flock, where fcntl is available), so a running execution is never resumed
+    '''
+    PREFIX = 'takeover_journal_'
+    SUFFIX = '.jsonl'
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = None
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def create(cls, db_folder_path, plan):
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix = cls.PREFIX, suffix = cls.SUFFIX, dir = str(db_folder_path))
+        os.close(fd)
+        journal = cls(path)
+        journal._file = open(path, 'w')
+        journal._try_lock(journal._file)
+        journal._file.write(json.dumps({'operations' : plan.operations(), 'rollback' : plan.rollback}) + '\n')
+        journal.sync()
+        return journal
+
+
+    @classmethod
+    def find(cls, db_folder_path):
+        '''return the journals left in the database folder by interrupted executions. journals of running executions are skipped'''
+        journals = list()
+        for path in sorted(pathlib.Path(db_folder_path).glob(cls.PREFIX + '*' + cls.SUFFIX)):
+            journal = cls(path)
+            if journal.in_use():
+                logging.info('{} belongs to a running command. skipped'.format(path))
+            else:
+                journals.append(journal)
+        return journals
+
+
+    @staticmethod
+    def _try_lock(f):
+        '''take an exclusive lock on the open file f without waiting. return False if it is locked by another execution'''
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+
+    def in_use(self):
+        try:
+            with open(self.path, 'r') as f:
+                return not self._try_lock(f)
+        except FileNotFoundError:
+            return False
+
+
+    def load(self):
+        '''return (plan, set of the indexes of the completed operations). a partially written last line is ignored'''
+        plan = operation_plan(list())
+        done = set()
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+        data = json.loads(lines[0])
+        for op in data['operations']:
+            if op['op'] not in plan._ops:
+                plan._order.append(op['op'])
+                plan._ops[op['op']] = list()
+            plan._ops[op['op']].append(op)
+        plan.rollback = data['rollback']
+        for line in lines[1:]:
+            try:
+                done.add(json.loads(line)['done'])
+            except ValueError:
+                pass
+        return plan, done
+
+
+    def reopen(self):
+        '''open the journal to continue it. return False if it is locked by a running execution'''
+        self._file = open(self.path, 'a')
+        if not self._try_lock(self._file):
+            self.close()
+            return False
+        return True
+
+
+    def close(self):
+        '''close the journal (releasing its lock), and keep it for "resume"'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def done(self, index):
+        with self._lock:
+            self._file.write('{"done" : %d}\n' % index)
+            self._file.flush()
+
+
+    def sync(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+    def remove(self):
+        # removed before it is closed, so it is never found unlocked
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.close()
+
+
+class plan_executor():
+    '''
+    executes an operation_plan. every stage (the operations of one kind) is done before the next one starts.
+    copies and moves use copy_engine, links are grouped by directory and the directories are handled in parallel.
+    if a critical stage fails, moved files are returned, the plan rollback operations are executed and the plan stops.
+    when the executor has a database, completed operations are recorded in an operation_journal until the execution ends
+    (or, inside a database batch, until the batch ends), so an interrupted execution can be resumed or rolled back
+    '''
+    CRITICAL = ('mkdir', 'copy', 'move', 'register', 'unregister')
+
+    def __init__(self, db = None, jobs = 1):
+        self._db = db
+        self._jobs = max(1, jobs or 1)
+        self._movers = list()
+        self._journal = None
+        self._index = dict()
+        # number of operations that succeeded / failed, by kind (only counted for link operations)
+        self.done = collections.Counter()
+        self.failed = collections.Counter()
+
+
+    def execute(self, plan, dryrun = False, journal = None, completed = None):
+        '''
+        execute the plan (only print it on dryrun). return False if any of the operations failed.
+        to resume an interrupted execution, pass its journal and the set of the completed operation indexes (see operation_journal.load)
+        '''
+        executed_ok = True
+        if dryrun:
+            for op in plan.operations():
+                logging.info('dryrun - {}'.format(operation_plan.describe(op)))
+        else:
+            self._index = {id(op) : i for i, op in enumerate(plan.operations())}
+            self._journal = journal
+            if journal is None and self._db is not None and len(plan) > 0:
+                self._journal = operation_journal.create(self._db._db_folder_path, plan)
+            completed = completed or set()
+            try:
+                for kind, ops in plan.stages():
+                    # database changes may not have been saved before the interruption. they are safe to repeat
+                    if kind not in ('register', 'unregister'):
+                        ops = [op for op in ops if self._index[id(op)] not in completed]
+                        if completed:
+                            ops = self._landed(kind, ops)
+                    if ops and not getattr(self, '_run_' + kind)(ops):
+                        executed_ok = False
+                        if kind in self.CRITICAL:
+                            logging.error('{} failed. rolling back'.format(kind))
+                            self._rollback(plan)
+                            break
+                    if self._journal is not None:
+                        self._journal.sync()
+            except BaseException:
+                # the execution was interrupted. its journal is kept (unlocked) for "resume"
+                if self._journal is not None:
+                    self._journal.close()
+                raise
+            self._close_journal()
+        return executed_ok
+
+
+    def _close_journal(self):
+        if self._journal is not None:
+            journal = self._journal
+            self._journal = None
+            if self._db is not None:
+                self._db.on_batch_end(journal.remove)
+            else:
+                journal.remove()
+
+
+    def _landed(self, kind, ops):
+        '''return the operations of an interrupted execution that still need to be done. 
+        copies to the blob store and moves whose file is already in place are skipped'''
+        remaining = list()
+        for op in ops:
+            landed = False
+            if kind in ('copy', 'move'):
+                dest_file = os.path.join(op['dest'], os.path.basename(op['src']))
+                landed = os.path.exists(dest_file) and (kind == 'move' and not os.path.lexists(op['src']) or kind == 'copy' and op.get('store'))
+            if landed:
+                self._completed(op)
+            else:
+                remaining.append(op)
+        return remaining
+
+
+    def _completed(self, op):
+        if self._journal is not None:
+            self._journal.done(self._index[id(op)])
+
+
+    def _rollback(self, plan):
+        for mover in self._movers:
+            mover.undo_move()
+        self._movers = list()
+        for op in plan.rollback:
+            getattr(self, '_run_' + op['op'])([op])
+
+
+    def undo(self, plan):
+        '''
+        roll back an interrupted take over plan, using the state of the file system: created links are removed, 
+        removed original files are copied back from the database, the item is unregistered and its storage is removed
+        '''
+        undo_ok = True
+        unregistered = False
+        if len([op for op in plan.operations() if op['op'] == 'register']) == 0:
+            logging.error('only a take over can be rolled back. use "resume" without --rollback to complete it')
+            return False
+        stored = dict()
+        for op in plan.operations():
+            if op['op'] in ('copy', 'move'):
+                stored[op['src']] = os.path.join(op['dest'], os.path.basename(op['src']))
+        for op in reversed(plan.operations()):
+            kind = op['op']
+            try:
+                if kind == 'symlink' and os.path.islink(op['path']) and os.readlink(op['path']) == op['target']:
+                    os.unlink(op['path'])
+                elif kind == 'rmdir':
+                    os.makedirs(op['path'], exist_ok = True)
+                elif kind in ('unlink', 'move'):
+                    original = op['path'] if kind == 'unlink' else op['src']
+                    if not os.path.lexists(original) and os.path.exists(stored.get(original, '')):
+                        os.makedirs(os.path.dirname(original), exist_ok = True)
+                        fast_copy(stored[original], original)
+                elif kind == 'register' and self._db._backend.get(op['entry']['database id']) is not None:
+                    # removing the item removes its storage as well
+                    undo_ok = self._db.remove_item(op['entry']['database id'], False) and undo_ok
+                    unregistered = True
+            except OSError:
+                logging.error('couldnt undo {}'.format(operation_plan.describe(op)))
+                undo_ok = False
+        if not unregistered:
+            for op in plan.rollback:
+                undo_ok = getattr(self, '_run_' + op['op'])([op]) and undo_ok
+        return undo_ok
+
+
+    def _by_directory(self, ops, action):
+        '''run action on every operation. operations in the same directory are done by the same worker'''
+        import concurrent.futures
+        groups = dict()
+        for op in ops:
+            groups.setdefault(os.path.dirname(op['path']), list()).append(op)
+        def run_group(group):
+            results = list()
+            for op in group:
+                results.append(action(op))
+                if results[-1]:
+                    self._completed(op)
+            return results
+        if self._jobs == 1 or len(groups) == 1:
+            results = [run_group(g) for g in groups.values()]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self._jobs) as pool:
+                results = list(pool.map(run_group, groups.values()))
+        results = [r for group_results in results for r in group_results]
+        if len(ops) > 0:
+            self.done[ops[0]['op']] += results.count(True)
+            self.failed[ops[0]['op']] += results.count(False)
+        return all(results)
+
+
+    def _engine_pairs(self, ops):
+        '''split copy or move operations by blob store. yield (copy_engine, [(src, dest), ...])'''
+        by_store = dict()
+        pair_ops = dict()
+        for op in ops:
+            by_store.setdefault(op.get('store'), list()).append((op['src'], op['dest']))
+            pair_ops[(op['src'], op['dest'])] = op
+        on_done = lambda pair: self._completed(pair_ops[pair])
+        for store, pairs in by_store.items():
+            yield copy_engine(self._jobs, blob_store(store) if store else None, on_done), pairs
+
+
+    def _run_mkdir(self, ops):
+        mkdir_ok = True
+        for op in ops:
+            try:
+                os.makedirs(op['path'], exist_ok = True)
+                self._completed(op)
+            except OSError:
+                logging.error('couldnt create directory {}'.format(op['path']))
+                mkdir_ok = False
+        return mkdir_ok
+
+
+    def _run_copy(self, ops):
+        return all([engine.copy(pairs, False) for engine, pairs in self._engine_pairs(ops)])
+
+
+    def _run_move(self, ops):
+        move_ok = True
+        for engine, pairs in self._engine_pairs(ops):
+            self._movers.append(engine)
+            if not engine.move(pairs, False):
+                move_ok = False
+        return move_ok
+
+
+    def _unlink_one(self, op):
+        unlink_ok = True
+        try:
+            os.unlink(op['path'])
+        except FileNotFoundError:
+            # already gone (eg: moved to the database)
+            pass
+        except OSError:
+            logging.error('couldnt remove {}'.format(op['path']))
+            unlink_ok = False
+        return unlink_ok
 
+
+    def _run_unlink(self, ops):
+        return self._by_directory(ops, self._unlink_one)
+
+
+    def _symlink_one(self, op):
+        link_ok = True
         try:
-            # validate the database object before writing
-            json_str = json.dumps(self._db_dict)
-            if not isinstance(json_str, str):
-                raise
-    
-            try:
-                db_file = open(self._db_file, 'w')
-                if db_file:            
-                    try:
-                        # write the database object to file
-                        json.dump(self._db_dict, db_file)
-                        db_saved = True
-                    except:
-                        logging.error('database save error - invalid database format')
-                db_file.close()
-            except:
-                db_file = None
-                logging.fatal('database save error - couldnt open database file for writing')
-    
-        except:
-            logging.error('database save validation error - invalid database format')
-            logging.debug('database object structure: {}'.format(self._db_dict))
+            os.symlink(op['target'], op['path'])
+        except FileExistsError:
+            # may be left by an interrupted execution
+            if not os.path.islink(op['path']) or os.readlink(op['path']) != op['target']:
+                logging.error('link creation in {} pointing to {} failed. a file with the same name already exist'.format(op['path'], op['target']))
+                link_ok = False
+        except OSError:
+            logging.error('link creation in {} pointing to {} failed'.format(op['path'], op['target']))
+            link_ok = False
+        return link_ok
 
-        return db_saved
 
+    def _run_symlink(self, ops):
+        return self._by_directory(ops, self._symlink_one)
 
-    def add_dir(self, dir_path, extensions,  database_path_alias = None, dryrun = False):
-        added_ok = False
-        item = None
-        name = pathlib.Path(dir_path).name
-        id = str(datetime.datetime.now())
-        id = re.sub('[- :.]', '', id)
-        id += '_' + name
-        
-        # load a db if not loaded
-        if self.load():
-            storage_dir = self._db_folder_path / id
-            if not dryrun:
-                storage_dir.mkdir()
-            else:
-                logging.info('dryrun - creating folder {} in database'.format(id))
 
-            # copy filtered files to local storage
-            new_entry = {
-                            "name" : name,
-                            "database id" : id,
-                            "is file" : pathlib.Path(dir_path).is_file(),
-                            "original path" : dir_path,
-                            "default database path" : str(self._db_folder_path) if database_path_alias is None else database_path_alias,
-                            "symlink path" : dir_path
-                        }
-            item = db_item(new_entry, self._db_folder_path, extensions)
+    def _run_register(self, ops):
+        return self._each(ops, lambda op: self._db.register_entry(op['entry']))
 
-            if not item.copy_original_files_to_db(dryrun) or len(list(storage_dir.glob('*'))) == 0:
-                # if local storage is empty remove it and stop
-                if not dryrun:
-                    try:
-                        shutil.rmtree(str(storage_dir))
-                    except:
-                        logging.error('nothing was copyed to {} but i could not remove it.'.format(storage_dir))
+
+    def _run_unregister(self, ops):
+        return self._each(ops, lambda op: self._db.remove_item(op['id'], False))
+
+
+    def _each(self, ops, action):
+        '''run action on every operation, one after the other. return False if any of them failed'''
+        all_ok = True
+        for op in ops:
+            if action(op):
+                self._completed(op)
             else:
-                # register in db dict
-                if dryrun:
-                    logging.info('dryrun - adding new entry {} to database'.format(name))
-                    added_ok = True
-                else:
-                    self._db_dict[new_entry['database id']] = new_entry
-                    # save db dict
-                    if self.save():
-                        added_ok = True
-                    else:
-                        shutil.rmtree(str(storage_dir))
+                all_ok = False
+        return all_ok
 
-        return added_ok, item
+
+    def _run_rmdir(self, ops):
+        # directories are removed in the order they were planned (sub directories first)
+        rmdir_ok = True
+        for op in ops:
+            try:
+                os.rmdir(op['path'])
+                self._completed(op)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.error('couldnt remove directory {}'.format(op['path']))
+                rmdir_ok = False
+        return rmdir_ok
 
 
-    def add_file(self, file):
-        pass
+    def _run_rmtree(self, ops):
+        import shutil
+        rmtree_ok = True
+        for op in ops:
+            try:
+                shutil.rmtree(op['path'])
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.error('couldnt remove {}'.format(op['path']))
+                rmtree_ok = False
+        return rmtree_ok
 
 
 class db_item():
     def __init__(self, db_entry, database_path, suffixes = None):
-        self._database_path = pathlib.Path(database_path)
+        # items are created for every entry when listing, so an existing path is not parsed again
+        self._database_path = database_path if isinstance(database_path, pathlib.Path) else pathlib.Path(database_path)
         self._db_entry_data = db_entry
         self._suffixes = suffixes
+        self._manifest = None
+        if self._suffixes is None:
+            self._suffixes = db_entry.get('extensions')
         if self._suffixes is not None:
             self._suffixes = ['.'+i.lstrip('.') for i in self._suffixes]
+        self._path_filter = path_filter(db_entry.get('include'), db_entry.get('exclude'))
 
 
     def get_id(self):
@@ -292,6 +2164,47 @@ class db_item():
         return root_path
 
 
+    def is_deduplicated(self):
+        return self._db_entry_data.get('deduplicated', False)
+
+
+    def has_relative_links(self):
+        '''return True if links point to the database with a path relative to the link'''
+        return self._db_entry_data.get('relative links', False)
+
+
+    def _link_base(self, db_path_alias = None):
+        '''return the path of the item in the database that links point to. relative links always use the database folder itself'''
+        if db_path_alias:
+            base = os.path.join(db_path_alias, self.get_id())
+        elif self.has_relative_links():
+            base = str(self.get_db_path())
+        else:
+            base = str(self.get_db_path_alias())
+        return base
+
+
+    def _link_target(self, link_path, target):
+        '''return the target to write in the link at link_path. for relative links, target is made relative to the link directory'''
+        if self.has_relative_links():
+            target = os.path.relpath(target, os.path.dirname(os.path.abspath(link_path)))
+        return target
+
+
+    def _points_to(self, link_path, target):
+        '''return True if the link at link_path already points to target'''
+        return os.path.normpath(os.readlink(link_path)) == os.path.normpath(self._link_target(link_path, target))
+
+
+    def has_directory_links(self):
+        '''return True if whole directories are linked to the database (instead of every file)'''
+        return self._db_entry_data.get('directory links', False) and not self.is_file()
+
+
+    def _blob_store(self):
+        return blob_store(self._database_path) if self.is_deduplicated() else None
+
+
     def get_db_path_alias(self):
         '''return the path of the item files root in the database. this is the path to be set in the link'''
         root_path = pathlib.Path(self._db_entry_data['default database path']) / self._db_entry_data['database id']
@@ -304,48 +2217,201 @@ class db_item():
     #    return False
 
 
-    def _copy_files(self, src_dest_pairs, dryrun):
-        '''src_dest_pairs is a list of (source, dest) tupples. both source and dest represent patht to file or directory'''
-        copy_ok = True
-        for p in src_dest_pairs:
-            src = pathlib.Path(p[0])
-            dest = pathlib.Path(p[1])
-            if dryrun:
-                if not dest.exists():
-                    logging.info('dryrun - creating missing directory {}'.format(dest))
-                logging.info('dryrun - copying file {} to {}'.format(src, dest))
-            else:
-                #create folder
-                try:
-                    dest.mkdir(parents = True, exist_ok = True)
-                    #copy files
-                    shutil.copy2(src, dest)
-                except:
-                    logging.error('copy file {} failed. may be a file with the same directory name already exist'.format(dest))
-                    copy_ok = False
-        return copy_ok
+    def _copy_files_to_db(self, src_dest_pairs, dryrun, jobs = 1):
+        return copy_engine(jobs, self._blob_store()).copy(src_dest_pairs, dryrun)
 
 
-    def copy_original_files_to_db(self, dryrun):
-        original_location = pathlib.Path(self.get_original_location())
-        db_item_path = pathlib.Path(self.get_db_path())
-        files_list = list()
-        if original_location.is_dir():
-            for root, dirs, files in os.walk(original_location):
-                filtered_files = files
-                #take only file matching the suffixs
-                if self._suffixes and len(self._suffixes) > 0:
-                    filtered_files = [f for f in files if os_case(pathlib.Path(f).suffix) in self._suffixes]
-                for f in filtered_files:
-                    src = pathlib.Path(root) / f
-                    if not src.is_symlink():
-                        relative_path = pathlib.Path(root).relative_to(original_location)
-                        dest = db_item_path / relative_path
-                        files_list.append((src, dest))
+    def _walk_suffixes(self):
+        '''the suffixes filter for walk_files'''
+        return self._suffixes if self._suffixes else None
+
+
+    def _walk_filter(self):
+        '''the path_filter for walk_files'''
+        return self._path_filter if self._path_filter else None
+
+
+    def _original_files(self):
+        '''return file_records of all the files to take over from the original location (symlinks are skipped)'''
+        original_location = self.get_original_location()
+        if os.path.islink(original_location):
+            # a directory link. the files are in the database already
+            files = list()
+        elif os.path.isdir(original_location):
+            files = [f for f in walk_files(original_location, self._walk_suffixes(), self._walk_filter()) if not f.is_symlink]
+        else:
+            name = os.path.basename(original_location)
+            files = [file_record(original_location, name, name, os.path.islink(original_location))]
+        return files
+
+
+    def _original_files_to_db_pairs(self, files = None):
+        '''return a list of (original file, database directory) tupples for the files to take over'''
+        db_item_path = str(self.get_db_path())
+        if files is None:
+            files = self._original_files()
+        return [(f.path, os.path.dirname(os.path.join(db_item_path, f.relative_path))) for f in files]
+
+
+    def _same_device_as_db(self):
+        '''return True if the original location and the database are on the same file system'''
+        same_device = False
+        try:
+            db_root = self.get_db_path() if self.get_db_path().exists() else self._database_path
+            same_device = os.stat(self.get_original_location()).st_dev == os.stat(db_root).st_dev
+        except OSError:
+            pass
+        return same_device
+
+
+    def plan_ingest(self, plan, files, move = False):
+        '''
+        add the operations that copy the file_records 'files' from the original location into the database.
+        if move is set and the database is on the same file system, the files are moved instead
+        '''
+        kind = 'copy'
+        if move:
+            if self._same_device_as_db():
+                kind = 'move'
+            else:
+                logging.debug('{} and the database are on different devices. files will be copied'.format(self.get_original_location()))
+        store = str(self._database_path) if self.is_deduplicated() else None
+        db_dirs = set()
+        for src, dest in self._original_files_to_db_pairs(files):
+            if dest not in db_dirs:
+                db_dirs.add(dest)
+                plan.add('mkdir', path = dest)
+            plan.add(kind, src = src, dest = dest, store = store)
+        plan.rollback.append({'op' : 'rmtree', 'path' : str(self.get_db_path())})
+
+
+    def copy_original_files_to_db(self, dryrun, jobs = 1):
+        '''copy the files of the original location into the database, --jobs files in parallel. return False if any copy failed'''
+        plan = operation_plan(operation_plan.TAKEOVER)
+        self.plan_ingest(plan, self._original_files())
+        return plan_executor(None, jobs).execute(plan, dryrun)
+
+
+    def move_original_files_to_db(self, dryrun, jobs = 1):
+        '''like copy_original_files_to_db, but the files are moved when the database is on the same file system'''
+        plan = operation_plan(operation_plan.TAKEOVER)
+        self.plan_ingest(plan, self._original_files(), True)
+        return plan_executor(None, jobs).execute(plan, dryrun)
+
+
+    def plan_takeover_links(self, plan, files):
+        '''add the operations that replace the taken over file_records 'files' with links to the database'''
+        db_path_for_link = self._link_base()
+        if self.has_directory_links():
+            def link_file(plan, link, target):
+                plan.add('unlink', path = link)
+                plan.add('symlink', path = link, target = self._link_target(link, target))
+                return 'planned'
+            relative_paths = [f.relative_path for f in files]
+            self._plan_dir_links(plan, '', self._tree(relative_paths), self.get_symlink_file_location(), db_path_for_link, link_file, set(relative_paths))
+        else:
+            for f in files:
+                plan.add('unlink', path = f.path)
+                plan.add('symlink', path = f.path, target = self._link_target(f.path, os.path.join(db_path_for_link, f.relative_path)))
+
+
+    @staticmethod
+    def _tree(relative_paths):
+        '''return {relative directory : (set of sub directory names, set of file names)} for a list of '/' separated relative file paths. the root is \'\' '''
+        tree = {'' : (set(), set())}
+        for relative_path in relative_paths:
+            parts = relative_path.split('/')
+            relative_dir = ''
+            for part in parts[:-1]:
+                sub_dir = relative_dir + '/' + part if relative_dir else part
+                if sub_dir not in tree:
+                    tree[sub_dir] = (set(), set())
+                    tree[relative_dir][0].add(part)
+                relative_dir = sub_dir
+            tree[relative_dir][1].add(parts[-1])
+        return tree
+
+
+    def _dir_is_managed(self, link_dir, relative_dir, tree, target_root, replaceable):
+        '''
+        return True if all the content of the (real) directory link_dir belongs to the item, so it can be replaced by a single link:
+        links pointing to the stored files, files in 'replaceable' (a set of relative paths) and directories that are managed as well
+        '''
+        sub_dirs, file_names = tree.get(relative_dir, (set(), set()))
+        try:
+            with os.scandir(link_dir) as entries:
+                entries = list(entries)
+        except OSError:
+            return False
+        for entry in entries:
+            relative_path = relative_dir + '/' + entry.name if relative_dir else entry.name
+            if entry.is_symlink():
+                managed = (entry.name in sub_dirs or entry.name in file_names) and \
+                    self._points_to(entry.path, os.path.join(target_root, relative_path))
+            elif entry.is_dir():
+                managed = entry.name in sub_dirs and self._dir_is_managed(entry.path, relative_path, tree, target_root, replaceable)
+            else:
+                managed = entry.name in file_names and relative_path in replaceable
+            if not managed:
+                return False
+        return True
+
+
+    def _plan_dir_removal(self, plan, dir_path):
+        '''add the operations that remove the directory and its content (sub directories are removed first)'''
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir() and not entry.is_symlink():
+                    self._plan_dir_removal(plan, entry.path)
+                else:
+                    plan.add('unlink', path = entry.path)
+        plan.add('rmdir', path = dir_path)
+
+
+    def _plan_dir_links(self, plan, relative_dir, tree, link_root, target_root, link_file, replaceable = frozenset(), results = None):
+        '''
+        add the operations that link the directory relative_dir (of the stored files tree, see _tree) with a single link.
+        if the directory holds files that dont belong to the item, its files and sub directories are linked one by one.
+        link_file(plan, link, target) plans a single link (of a file, or of a directory that is not a real directory)
+        and returns its status (see _plan_link). results is a Counter of the statuses. return results
+        '''
+        if results is None:
+            results = collections.Counter()
+        link_dir = os.path.join(link_root, relative_dir) if relative_dir else link_root
+        target_dir = os.path.join(target_root, relative_dir) if relative_dir else target_root
+        if os.path.isdir(link_dir) and not os.path.islink(link_dir):
+            if self._dir_is_managed(link_dir, relative_dir, tree, target_root, replaceable):
+                self._plan_dir_removal(plan, link_dir)
+                plan.add('symlink', path = link_dir, target = self._link_target(link_dir, target_dir))
+                results['planned'] += 1
+            else:
+                logging.debug('{} holds files that dont belong to {}. its content is linked one by one'.format(link_dir, self.get_id()))
+                sub_dirs, file_names = tree[relative_dir]
+                for name in sorted(sub_dirs):
+                    self._plan_dir_links(plan, relative_dir + '/' + name if relative_dir else name, tree, link_root, target_root, link_file, replaceable, results)
+                for name in sorted(file_names):
+                    results[link_file(plan, os.path.join(link_dir, name), os.path.join(target_dir, name))] += 1
         else:
-            files_list.append((original_location, db_item_path))
-        return self._copy_files(files_list, dryrun)
-                
+            results[link_file(plan, link_dir, target_dir)] += 1
+        return results
+
+
+    def _link_points(self):
+        '''yield the existing links of the item: directory links, and links of stored files that are not under a directory link'''
+        tree = self._tree(self.load_manifest().files)
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+            link_dir = os.path.join(self.get_symlink_file_location(), relative_dir) if relative_dir else self.get_symlink_file_location()
+            if os.path.islink(link_dir):
+                yield link_dir
+            elif os.path.isdir(link_dir):
+                sub_dirs, file_names = tree[relative_dir]
+                stack.extend([relative_dir + '/' + name if relative_dir else name for name in sub_dirs])
+                for name in file_names:
+                    if os.path.islink(os.path.join(link_dir, name)):
+                        yield os.path.join(link_dir, name)
+
 
     #def copy_tree_to(self, dryrun):
     #    # TODO remember to ignore symlinks
@@ -353,56 +2419,318 @@ class db_item():
     #    return False
 
 
-    def delete_created_links(self, dryrun):
-        '''remove links pointing to the database item's'''
-        item_removed = True
-        symlink_base_path = pathlib.Path(self.get_symlink_file_location())
-        db_path_base = pathlib.Path(self.get_db_path_alias())
+    def stats(self):
+        '''the statistics cached in the database entry (see sources_db.record_stats). empty if none were recorded'''
+        return self._db_entry_data.get('stats') or dict()
+
+
+    def _link_health_path(self):
+        return self._database_path / (self.get_id() + '.stats.json')
+
+
+    def link_health(self):
+        '''return the link health recorded by status: {"ok" : int, "drifted" : int, "since" : time the counts were first found}, or None'''
+        try:
+            with open(self._link_health_path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    def record_link_health(self, ok, drifted):
+        '''
+        keep the number of correct and drifted links found by status in <database folder>/<database id>.stats.json.
+        it is kept out of the database so checking never rewrites it, and the file is written only when the counts change
+        '''
+        import datetime
+        health = self.link_health()
+        if health is None or health.get('ok') != ok or health.get('drifted') != drifted:
+            try:
+                atomic_write(self._link_health_path(), json.dumps({'ok' : ok, 'drifted' : drifted, 'since' : datetime.datetime.now().isoformat(timespec = 'seconds')}))
+            except OSError:
+                logging.error('couldnt write {}'.format(self._link_health_path()))
+
+
+    def get_manifest(self):
+        return item_manifest(self._database_path / (self.get_id() + '.manifest.json'))
+
+
+    def build_manifest(self, hash_files = False, previous = None):
+        '''record all the files stored in the database for this item.
+        the files are hashed only if hash_files is set (on ingest), otherwise the hashes are taken from previous (the old manifest) where the files are unchanged'''
+        manifest = self.get_manifest()
+        db_path = self.get_db_path()
+        for f in walk_files(db_path):
+            if hash_files:
+                manifest.add(f.relative_path, f.path)
+            else:
+                manifest.add_unhashed(f.relative_path, f.path, previous.files.get(f.relative_path) if previous is not None else None)
+        if db_path.exists():
+            manifest.save()
+        self._manifest = manifest
+        return manifest
+
+
+    def load_manifest(self, rescan = False):
+        '''return the item manifest, building it from the database folder if it is missing or rescan is set.
+        the manifest is kept, so following calls dont read it again'''
+        if rescan or self._manifest is None:
+            manifest = self.get_manifest()
+            loaded = manifest.load()
+            if rescan or not loaded:
+                manifest = self.build_manifest(previous = manifest if loaded else None)
+            self._manifest = manifest
+        return self._manifest
+
+
+    def status(self):
+        '''
+        compare the links of the item to its stored files, with a single directory listing per linked directory and a readlink per link.
+        return {"ok" : number of correct links, "missing" : [...], "replaced" : [...], "dangling" : [...], "wrong target" : [...], "unmanaged" : [...]}
+        where every list holds link paths: missing - the link doesnt exist, replaced - a real file (or directory) is where the link should be,
+        dangling - the link points to a stored file that doesnt exist, wrong target - the link points elsewhere,
+        unmanaged - a new file in a taken over directory, that matches the item filters (see update)
+        '''
+        result = {'ok' : 0, 'missing' : [], 'replaced' : [], 'dangling' : [], 'wrong target' : [], 'unmanaged' : []}
+        relative_paths = list(self.load_manifest().files)
+        tree = self._tree(relative_paths)
+        # a snapshot of the stored files, instead of a stat through every link
+        stored = set([f.relative_path for f in walk_files(self.get_db_path())])
+        base = self._link_base()
+        join = lambda relative_dir, name: relative_dir + '/' + name if relative_dir else name
+        suffixes = frozenset(self._walk_suffixes()) if self._walk_suffixes() else None
+
+        def check_link(link, relative_path, is_dir):
+            target = os.path.join(base, relative_path) if relative_path else base
+            if not self._points_to(link, target):
+                result['wrong target'].append(link)
+            elif (is_dir and not os.path.isdir(link)) or (not is_dir and relative_path not in stored):
+                result['dangling'].append(link)
+            else:
+                result['ok'] += 1
+
+        def all_missing(dir_path, relative_dir):
+            prefix = relative_dir + '/'
+            result['missing'].extend([os.path.join(dir_path, r[len(prefix):]) for r in relative_paths if r.startswith(prefix)])
+
+        def visit(dir_path, relative_dir):
+            sub_dirs, file_names = tree.get(relative_dir, (set(), set()))
+            try:
+                with os.scandir(dir_path) as entries:
+                    entries = {e.name : e for e in entries}
+            except OSError:
+                all_missing(dir_path, relative_dir)
+                return
+            for name in file_names:
+                entry = entries.get(name)
+                if entry is None:
+                    result['missing'].append(os.path.join(dir_path, name))
+                elif entry.is_symlink():
+                    check_link(entry.path, join(relative_dir, name), False)
+                else:
+                    result['replaced'].append(entry.path)
+            for name in sub_dirs:
+                entry = entries.get(name)
+                if entry is None:
+                    all_missing(os.path.join(dir_path, name), join(relative_dir, name))
+                elif entry.is_symlink() and self.has_directory_links():
+                    check_link(entry.path, join(relative_dir, name), True)
+                elif entry.is_dir():
+                    visit(entry.path, join(relative_dir, name))
+                else:
+                    result['replaced'].append(entry.path)
+            for name, entry in entries.items():
+                relative_path = join(relative_dir, name)
+                if name in file_names or name in sub_dirs or entry.is_symlink():
+                    continue
+                if entry.is_dir():
+                    if not self._path_filter.dir_excluded(relative_path):
+                        result['unmanaged'].extend([f.path for f in walk_files(entry.path, suffixes, self._walk_filter(), relative_path + '/') if not f.is_symlink])
+                elif (suffixes is None or os_case(os.path.splitext(name)[1]) in suffixes) and self._path_filter.file_included(relative_path):
+                    result['unmanaged'].append(entry.path)
+
+        link_root = self.get_symlink_file_location()
         if self.is_file():
-            dest_file = symlink_base_path
-            self._delete_symlink(dest_file, dryrun)
+            if not os.path.lexists(link_root):
+                result['missing'].append(link_root)
+            elif not os.path.islink(link_root):
+                result['replaced'].append(link_root)
+            elif len(relative_paths) == 1:
+                check_link(link_root, relative_paths[0], False)
+        elif self.has_directory_links() and os.path.islink(link_root):
+            check_link(link_root, '', True)
         else:
-            if db_path_base.exists():
-                for root, dirs, files in os.walk(db_path_base):
-                    for f in files:
-                        db_file = pathlib.Path(root) / f
-                        relative_dest = db_file.relative_to(db_path_base)
-                        dest_file = symlink_base_path / relative_dest
-                        if dest_file.is_symlink(): 
-                            if not self._delete_symlink(dest_file, dryrun): 
-                                item_removed = False
+            visit(link_root, '')
+        return result
+
+
+    def files_to_verify(self, changed_only = False, since = None):
+        '''
+        return (problems, files) for the verify command:
+        problems - {relative path : "missing" / "unrecorded"} for stored files that are missing, or are not in the manifest.
+        files - list of (relative path, stored file path, changed) of the files to hash. changed is True if the size or modification time is not the recorded one.
+        changed_only - only files with a changed size or modification time are hashed
+        since - only files modified after this time (ns since the epoch) are hashed
+        '''
+        problems = dict()
+        files = list()
+        manifest = self.load_manifest()
+        db_path = str(self.get_db_path())
+        for relative_path in manifest.files:
+            file_path = os.path.join(db_path, relative_path)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                problems[relative_path] = 'missing'
+                continue
+            changed = not manifest.is_unchanged(relative_path, st)
+            if (changed_only and not changed) or (since is not None and st.st_mtime_ns < since):
+                continue
+            files.append((relative_path, file_path, changed))
+        if not changed_only and since is None:
+            for f in walk_files(db_path):
+                if f.relative_path not in manifest.files:
+                    problems[f.relative_path] = 'unrecorded'
+        return problems, files
+
+
+    def records_for(self, paths):
+        '''return file_records for the paths (in the original location) that should be taken over: existing real files that match the item filters'''
+        root = self.get_original_location()
+        if self.is_file():
+            root = os.path.dirname(root)
+        suffixes = self._walk_suffixes()
+        records = list()
+        for path in sorted(set(paths)):
+            relative_path = os.path.relpath(path, root).replace(os.sep, '/')
+            if self.is_file() and relative_path != os.path.basename(self.get_original_location()):
+                continue
+            if relative_path.startswith('../') or os.path.islink(path) or not os.path.isfile(path):
+                continue
+            if suffixes and os_case(os.path.splitext(path)[1]) not in suffixes:
+                continue
+            parts = relative_path.split('/')
+            if any([self._path_filter.dir_excluded('/'.join(parts[:i])) for i in range(1, len(parts))]) or not self._path_filter.file_included(relative_path):
+                continue
+            records.append(file_record(path, relative_path, parts[-1], False))
+        return records
+
+
+    def update(self, dryrun = False, jobs = 1, files = None):
+        '''
+        take over only the files that were added or changed in the original location since the item manifest was written.
+        a changed file is a real file where a link to the database is expected. only those files are copied and linked.
+        files - if set, only these file_records are checked (see records_for), instead of scanning the whole original location
+        '''
+        update_ok = True
+        # files added through a directory link are already in the database. only the manifest needs them
+        manifest = self.load_manifest(self.has_directory_links() and files is None)
+        db_path = self.get_db_path()
+        # refresh records of files edited through their links
+        for relative_path in (list(manifest.files) if files is None else list()):
+            db_file = db_path / relative_path
+            try:
+                st = db_file.stat()
+            except OSError:
+                manifest.files.pop(relative_path)
+                continue
+            if not manifest.is_unchanged(relative_path, st):
+                manifest.add(relative_path, db_file)
+
+        new_files = list()
+        changed_files = list()
+        for f in (self._original_files() if files is None else files):
+            if f.is_symlink:
+                continue
+            record = manifest.files.get(f.relative_path)
+            if record is None:
+                new_files.append(f)
+            elif record[3] is None or record[0] != os.stat(f.path).st_size or record[3] != file_hash(f.path):
+                changed_files.append(f)
+            else:
+                # same content as stored. only the link is missing
+                self._delete_file(f.path, dryrun)
+                self._create_link(f.path, os.path.join(self._link_base(), f.relative_path), True, dryrun)
+        logging.info('item {}: {} new files, {} changed files'.format(self.get_id(), len(new_files), len(changed_files)))
+
+        store = self._blob_store()
+        for f in changed_files:
+            # never write into the stored file, it may be shared with other items
+            self._delete_file(db_path / f.relative_path, dryrun)
+            if store is not None and not dryrun:
+                old_digest = manifest.files[f.relative_path][3]
+                old_blob = store.blob_path(old_digest) if old_digest is not None else None
+                if old_blob is not None and old_blob.exists() and old_blob.stat().st_nlink == 1:
+                    old_blob.unlink()
+        ingest_files = new_files + changed_files
+        if not self._copy_files_to_db(self._original_files_to_db_pairs(ingest_files), dryrun, jobs):
+            update_ok = False
+        for f in ingest_files:
+            db_file = db_path / f.relative_path
+            if not dryrun:
+                if not db_file.exists():
+                    update_ok = False
+                    continue
+                manifest.add(f.relative_path, db_file)
+            if self._delete_file(f.path, dryrun):
+                self._create_link(f.path, os.path.join(self._link_base(), f.relative_path), True, dryrun)
             else:
-                logging.error('trytin to delete links to database item {}, but the item does not exist'.format(db_path_base))
-        return item_removed
+                update_ok = False
+        if not dryrun:
+            manifest.save()
+        return update_ok
 
 
-    def _delete_symlink(self, link, dryrun):
-        ''' try to delete the symlink given in"link" '''
-        delete_ok = True
-        if dryrun:
-            logging.info('dryrun - removing the link {}'.format(link))
-        else:
-            lnk = pathlib.Path(link)
-            if lnk.is_symlink():
-                try:
-                    lnk.unlink()
-                except:
-                    logging.error('could not remove the link {}. May be it is use'. foramt(link))
-                    delete_ok = False
+    def plan_delete_links(self, plan):
+        '''add the operations that remove links pointing to the database item's'''
+        symlink_base_path = self.get_symlink_file_location()
+        if self.is_file():
+            if os.path.islink(symlink_base_path):
+                plan.add('unlink', path = symlink_base_path)
+        elif self.get_db_path().exists():
+            if self.has_directory_links():
+                for link in self._link_points():
+                    plan.add('unlink', path = link)
             else:
-                logging.error('requested link delete, but {} is not a symlink'.format(link))
-                delete_ok = False
-        return delete_ok
+                for relative_path in self.load_manifest().files:
+                    dest_file = os.path.join(symlink_base_path, relative_path)
+                    if os.path.islink(dest_file):
+                        plan.add('unlink', path = dest_file)
+        else:
+            logging.error('trytin to delete links to database item {}, but the item does not exist'.format(self.get_db_path()))
+
+
+    def delete_created_links(self, dryrun):
+        '''remove links pointing to the database item's'''
+        plan = operation_plan(operation_plan.REMOVE)
+        self.plan_delete_links(plan)
+        return plan_executor().execute(plan, dryrun)
+
+
+    def _remove_link_health(self):
+        if self._link_health_path().exists():
+            self._link_health_path().unlink()
 
 
     def delete_from_storage(self, dryrun):
         '''remove the database item's files'''
+        import shutil
         folder_removed = True
         if dryrun:
             logging.info('dryrun - removing item directory {} and all of its content from the databse'.format(self.get_db_path()))
+        elif self.is_deduplicated():
+            try:
+                self._blob_store().release(self.get_db_path(), self.load_manifest())
+                self.get_manifest().remove()
+                self._remove_link_health()
+            except:
+                folder_removed = False
+                logging.error('couldnt remove folder {} from database'.format(self.get_db_path()))
         else:
             try:
                 shutil.rmtree(self.get_db_path())
+                self.get_manifest().remove()
+                self._remove_link_health()
             except:
                 folder_removed = False
                 logging.error('couldnt remove folder {} from database'.format(self.get_db_path()))
@@ -425,202 +2753,927 @@ class db_item():
         return link_removed
 
 
+    def plan_delete_original_files(self, plan):
+        '''add the operations that remove the original files (not links) that were taken over'''
+        symlink_path = self.get_symlink_file_location()
+        if os.path.islink(symlink_path):
+            pass
+        elif os.path.isdir(symlink_path):
+            for f in walk_files(symlink_path, self._walk_suffixes(), self._walk_filter()):
+                if not f.is_symlink:
+                    plan.add('unlink', path = f.path)
+        elif os.path.isfile(symlink_path) and not os.path.islink(symlink_path):
+            plan.add('unlink', path = symlink_path)
+
+
     def delete_original_files(self, dryrun = False):
-        item_removed = True
-        symlink_path = pathlib.Path(self.get_symlink_file_location())
-        if symlink_path.exists() or symlink_path.is_symlink():
-            if symlink_path.is_dir():
-                for root, dirs, files in os.walk(symlink_path):
-                    filtered_files = files
-                    if self._suffixes is not None:
-                        filtered_files = [i for i in files if os_case(pathlib.Path(i).suffix) in self._suffixes]
-                    for f in filtered_files:
-                        file_path = pathlib.Path(root) / f
-                        if not file_path.is_symlink():
-                            if not self._delete_file(file_path, dryrun): 
-                                item_removed = False
-            elif not symlink_path.is_symlink():
-                if not self._delete_file(symlink_path, dryrun): 
-                    item_removed = False
-               
-        return item_removed
+        plan = operation_plan(operation_plan.REMOVE)
+        self.plan_delete_original_files(plan)
+        return plan_executor().execute(plan, dryrun)
 
-    
-    def copy_to_original_location(self, db_path_alias = None, force = None, dryrun = None):
-        original_location = pathlib.Path(self.get_original_location())
-        db_item_path = pathlib.Path(self.get_db_path_alias())
+
+    def plan_restore(self, plan, force = False):
+        '''add the operations that copy the stored files back to the original location. existing files are replaced only if force is set'''
+        original_location = self.get_original_location()
+        db_item_path = str(self.get_db_path())
+        relative_paths = list(self.load_manifest().files)
         files_list = list()
-        if original_location.is_dir():
-            for root, dirs, files in os.walk(db_item_path):
-                filtered_files = files
-                #take only file matching the suffixs
-                if self._suffixes and len(self._suffixes) > 0:
-                    filtered_files = [f for f in files if os_case(pathlib.Path(f).suffix) in self._suffixes]
-                for f in filtered_files:
-                    src = pathlib.Path(root) / f
-                    if not src.is_symlink():
-                        relative_path = src.relative_to(db_item_path)
-                        dest = original_location / relative_path
-                        if dest.exists():
-                            if force:
-                                dest.unlink()
-                                files_list.append((src, dest.parent))
-                            else:
-                                logging.info('file {} already exist in destination. it will not be retored. use --force to replace the existing file'.format(dest))
-                        else:
-                            files_list.append((src, dest))
-        else:
-            if len(db_item_path.iterdir()) > 1:
-                logging.error('weird shit. item {} took over one file but there are more in database'.format(str(db_item_path)))
-            else:
-                db_item_file = db_item_path.iterdir()[0] #assuming only one file in the directory
-                files_list.append((db_item_file, original_location))
-        return self._copy_files(files_list, dryrun)
+        # directory links are removed first (with force), the files under them are restored into new directories
+        removed_dirs = list()
+        kept_dirs = list()
+        if self.has_directory_links():
+            for link in self._link_points():
+                if os.path.isdir(link):
+                    if force:
+                        plan.add('unlink', path = link)
+                        removed_dirs.append(link + os.sep)
+                    else:
+                        logging.info('directory {} is a link to the database. its files will not be retored. use --force to replace it'.format(link))
+                        kept_dirs.append(link + os.sep)
+        if not self.is_file():
+            #take only file matching the suffixs
+            if self._suffixes and len(self._suffixes) > 0:
+                relative_paths = [f for f in relative_paths if os_case(os.path.splitext(f)[1]) in self._suffixes]
+            for relative_path in relative_paths:
+                files_list.append((os.path.join(db_item_path, relative_path), os.path.join(original_location, relative_path)))
+        elif len(relative_paths) > 1:
+            logging.error('weird shit. item {} took over one file but there are more in database'.format(db_item_path))
+        elif len(relative_paths) == 1:
+            files_list.append((os.path.join(db_item_path, relative_paths[0]), original_location))
+
+        dest_dirs = set()
+        for src, dest in files_list:
+            if any([dest.startswith(d) for d in kept_dirs]):
+                continue
+            removed = any([dest.startswith(d) for d in removed_dirs])
+            if os.path.lexists(dest) and not removed:
+                if not force:
+                    logging.info('file {} already exist in destination. it will not be retored. use --force to replace the existing file'.format(dest))
+                    continue
+                plan.add('unlink', path = dest)
+            dest_dir = os.path.dirname(dest)
+            if dest_dir not in dest_dirs:
+                dest_dirs.add(dest_dir)
+                if removed or not os.path.isdir(dest_dir):
+                    plan.add('mkdir', path = dest_dir)
+            plan.add('copy', src = src, dest = dest_dir, store = None)
+
+
+    def copy_to_original_location(self, db_path_alias = None, force = None, dryrun = None, jobs = 1):
+        plan = operation_plan(operation_plan.RESTORE)
+        self.plan_restore(plan, force)
+        return plan_executor(None, jobs).execute(plan, dryrun)
+
+
+    def plan_links(self, plan, db_path_alias = None, force = False, reconcile = False):
+        '''add the operations that create links to all the stored files. return a Counter of the _plan_link results ("planned", "unchanged", "skipped").
+        with reconcile, links that already point to the right file are left alone (see _plan_link).
+        db_path_alias is an alternative path to the database folder. eg: "\\\\192.168.50.1\\git\\database" instead of "c:\\git\\database" '''
+        db_path_for_link = self._link_base(db_path_alias)
+        symlink_root_dir = self.get_symlink_file_location()
+        # if working with file, use its parent dir
+        if self.is_file():
+            symlink_root_dir = os.path.dirname(symlink_root_dir)
+        planned_dirs = set()
+        if self.has_directory_links():
+            link_file = lambda plan, link, target: self._plan_link(plan, link, target, force, planned_dirs, reconcile)
+            return self._plan_dir_links(plan, '', self._tree(self.load_manifest().files), symlink_root_dir, db_path_for_link, link_file)
+        results = collections.Counter()
+        for relative_path in self.load_manifest().files:
+            symlink_file_location = os.path.join(symlink_root_dir, relative_path)
+            db_file_location = os.path.join(db_path_for_link, relative_path)
+            results[self._plan_link(plan, symlink_file_location, db_file_location, force, planned_dirs, reconcile)] += 1
+        return results
 
 
     def create_all_links(self, db_path_alias = None, force = False, dryrun = False):
-        '''db_path_alias is an alternative path to the database folder. eg: "\\192.168.50.1\git\database" instead of "c:\git\database" '''
-        db_path = self.get_db_path()
-        db_path_for_link = pathlib.Path(self.get_db_path_alias())
-        symlink_root_dir = pathlib.Path(self.get_symlink_file_location())
-        # if working with file, use its parent dir
-        if self.is_file():
-            symlink_root_dir = symlink_root_dir.parent
-        if db_path_alias:
-            db_path_for_link = pathlib.Path(db_path_alias) / self._db_entry_data['database id']
-        for root, dirs, files in os.walk(db_path):
-            for file in files:
-                relative_file_path = pathlib.Path(root).relative_to(db_path)
-                symlink_file_location = symlink_root_dir / relative_file_path / file
-                db_file_location = db_path_for_link / relative_file_path / file
-                self._create_link(symlink_file_location, db_file_location, force, dryrun)
+        '''db_path_alias is an alternative path to the database folder. eg: "\\\\192.168.50.1\\git\\database" instead of "c:\\git\\database" '''
+        plan = operation_plan(operation_plan.LINKS)
+        self.plan_links(plan, db_path_alias, force)
+        return plan_executor().execute(plan, dryrun)
 
 
-    def _create_link(self, symlink_file_location, db_file_location, force = False, dryrun = False):
+    def _plan_link(self, plan, symlink_file_location, db_file_location, force = False, planned_dirs = None, reconcile = False):
         ''' 
-        symlink_file_location - pathlike object, representing location to put the symbolic link
-        db_file_location - pathlike object, representing location where the actual file is
-        The fuction creates a link in 'symlink_file_location' pointing to 'db_file_location'.
-        If 'symlink_file_location' file already exists, return False.
+        symlink_file_location - path, representing location to put the symbolic link
+        db_file_location - path, representing location where the actual file is. for items with relative links,
+        the link gets the path of db_file_location relative to the link directory
+        Add the operations that create a link in 'symlink_file_location' pointing to 'db_file_location'.
+        If 'symlink_file_location' file already exists, nothing is added and "skipped" is returned.
         If 'symlink_file_location' file already exists and force is True, 
         'symlink_file_location' will be deleted and a new link will be created
-        Return True on success, False on failure'''
-        link_created = False
-        ready_to_link = True
-        symlink_file = pathlib.Path(symlink_file_location)
-        db_file = pathlib.Path(db_file_location)
+        With reconcile, an existing link pointing to 'db_file_location' is left alone ("unchanged" is returned), 
+        and an existing link pointing elsewhere is replaced even without force
+        planned_dirs is an optional set of directories already known to exist (or to be created by the plan)
+        Return "planned" if the link was planned'''
+        result = 'planned'
+        symlink_file = str(symlink_file_location)
+        db_file = str(db_file_location)
         # check if file exists with the same name as the required link
-        if symlink_file.exists() or symlink_file.is_symlink():
-            if symlink_file.is_dir():
+        if os.path.lexists(symlink_file):
+            is_link = os.path.islink(symlink_file)
+            if reconcile and is_link and self._points_to(symlink_file, db_file):
+                result = 'unchanged'
+            elif os.path.isdir(symlink_file) and not is_link:
                 logging.error('link creation from {} to {} failed. both must not be directories'.format(db_file, symlink_file))
-                ready_to_link = False
-            elif symlink_file.is_file():
-                # remove the existing file if requested
-                if not force:
-                    logging.error('link creation in {} failed, a file with the same name already exist. use "force" to remove the existing file'.format(symlink_file))
-                    ready_to_link = False
-                else:
-                    symlink_file.unlink()
-        if ready_to_link:
-            if dryrun:
-                if not symlink_file.parent.exists(): 
-                    logging.info('dryrun - creating missing directories tree: {}'.format(symlink_file.parent))
-                logging.info('dryrun - creating a link in {} pointinh to {}'.format(symlink_file, db_file))
+                result = 'skipped'
+            elif not force and not (reconcile and is_link):
+                # remove the existing file only if requested
+                logging.error('link creation in {} failed, a file with the same name already exist. use "force" to remove the existing file'.format(symlink_file))
+                result = 'skipped'
             else:
-                #create directories tree if needed
-                if not symlink_file.parent.exists(): 
-                    symlink_file.parent.mkdir(parents = True, exist_ok = True)
-                symlink_file.symlink_to(db_file)
-                link_created = True
-        return link_created
+                plan.add('unlink', path = symlink_file)
+        else:
+            #create directories tree if needed
+            parent = os.path.dirname(symlink_file)
+            if planned_dirs is None or parent not in planned_dirs:
+                if planned_dirs is not None:
+                    planned_dirs.add(parent)
+                if not os.path.isdir(parent):
+                    plan.add('mkdir', path = parent)
+        if result == 'planned':
+            plan.add('symlink', path = symlink_file, target = self._link_target(symlink_file, db_file))
+        return result
+
+
+    def _create_link(self, symlink_file_location, db_file_location, force = False, dryrun = False):
+        '''create a single link now. see _plan_link. Return True if the link was created'''
+        plan = operation_plan(operation_plan.LINKS)
+        return self._plan_link(plan, symlink_file_location, db_file_location, force) == 'planned' and plan_executor().execute(plan, dryrun) and not dryrun
 
 
 # sub-command functions
-def take_over(args):
-    if args.extensions is not None:
-        args.extensions = [os_case(e) for e in args.extensions]
-    dest_path = pathlib.Path(args.path)
+def run_plan(plan, db, args):
+    '''save the plan to args.plan if it is set, otherwise execute it (only print it on dryrun)'''
+    plan_file = getattr(args, 'plan', None)
+    if plan_file:
+        plan_ok = plan.save(plan_file)
+        if plan_ok:
+            logging.info('plan with {} operations saved to {}'.format(len(plan), plan_file))
+    else:
+        plan_ok = plan_executor(db, getattr(args, 'jobs', 1)).execute(plan, args.dryrun)
+    return plan_ok
+
+
+def read_paths(args):
+    '''return the paths to take over: args.path (a path or a list of paths) and the lines of the --from-file file ("-" for stdin)'''
+    paths = list()
+    if isinstance(args.path, str):
+        paths.append(args.path)
+    elif args.path:
+        paths.extend(args.path)
+    from_file = getattr(args, 'from_file', None)
+    if from_file:
+        with (contextlib.nullcontext(sys.stdin) if from_file == '-' else open(from_file, 'r')) as f:
+            paths.extend([line.strip() for line in f if line.strip() and not line.startswith('#')])
+    return paths
+
+
+def plan_take_over(db, path, args, plan):
+    '''add the operations that take over path to plan. return (db_item, number of files), or (None, 0) if there is nothing to take over'''
+    item = None
+    files = list()
+    dest_path = pathlib.Path(path)
     if dest_path.exists() and not dest_path.is_symlink():
-        db = sources_db()
-        added, db_item = db.add_dir(args.path, args.extensions, args.target, args.dryrun)
-        if added:
-            # remove original file
-            db_item.delete_original_files(args.dryrun)
-            # link from required dest to local storage
-            db_item.create_all_links(None, True, args.dryrun)
+        item, files = db.plan_add_dir(plan, path, args.extensions, args.target, getattr(args, 'move', False), getattr(args, 'dedup', False), 
+                                      getattr(args, 'include', None), getattr(args, 'exclude', None), getattr(args, 'dir_links', False), 
+                                      getattr(args, 'relative', False))
+        if files:
+            # remove original files and link from required dest to local storage
+            item.plan_takeover_links(plan, files)
     else:  
         logging.error('couldnt take over {}. Path doesnt exist, or it is a symbolik link'.format(dest_path))        
-        
+    return (item, len(files)) if files else (None, 0)
 
-def restore_source(args):
+
+def take_over(args):
+    '''
+    take over all the paths (see read_paths). the paths are taken over in parallel by --jobs workers, and the database is written once.
+    return a report - a list of {"path" : string, "status" : "taken over" / "planned" / "failed" / "skipped", "database id" : string or None, "files" : int}.
+    the report is also written as json to args.report if it is set ("-" for stdout)
+    '''
+    import concurrent.futures
+    if args.extensions is not None:
+        args.extensions = [os_case(e) for e in args.extensions]
+    paths = read_paths(args)
+    jobs = max(1, getattr(args, 'jobs', 1) or 1)
     db = sources_db()
-    if args.name is not None:
-        db_item = db.find_item(args.name)
-        if db_item:
-            db_item.copy_to_original_location(None, args.force, args.dryrun)        
-            if args.remove:
-                db.remove_item(args.name, args.dryrun)
+    report = list()
+    if not db.load():
+        logging.error('couldnt load the database. use the "init" command to create one')
+    elif getattr(args, 'plan', None):
+        # a single plan for all paths
+        plan = operation_plan(operation_plan.TAKEOVER)
+        for path in paths:
+            item, files = plan_take_over(db, path, args, plan)
+            report.append({'path' : path, 'status' : 'planned' if item else 'skipped', 'database id' : item.get_id() if item else None, 'files' : files})
+        if len(plan) > 0:
+            run_plan(plan, db, args)
     else:
-        # using list instead of iterator because removing items from the directory changes the list during iteration
-        for i in list(db.all_items()): 
-            i.copy_to_original_location(None, args.force, args.dryrun)
-            if args.remove:
-                db.remove_item(i.get_id(), args.dryrun)
+        def take_over_path(path):
+            plan = operation_plan(operation_plan.TAKEOVER)
+            item, files = plan_take_over(db, path, args, plan)
+            status = 'skipped'
+            if item is not None:
+                # with several paths, the paths are copied in parallel instead of the files of every path
+                taken = plan_executor(db, 1 if len(paths) > 1 else jobs).execute(plan, args.dryrun)
+                status = ('planned' if args.dryrun else 'taken over') if taken else 'failed'
+            return {'path' : path, 'status' : status, 'database id' : item.get_id() if item else None, 'files' : files}
+
+        with db.batch():
+            if jobs == 1 or len(paths) < 2:
+                report = [take_over_path(p) for p in paths]
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as pool:
+                    report = list(pool.map(take_over_path, paths))
+        if len(paths) > 1:
+            counts = collections.Counter([r['status'] for r in report])
+            logging.info('{} paths - {}'.format(len(paths), ', '.join(['{}: {}'.format(k, v) for k, v in sorted(counts.items())])))
+    write_report(report, getattr(args, 'report', None))
+    return report
 
 
-def init(args):
+def write_report(report, report_file):
+    '''write report as json to report_file ("-" for stdout). nothing is written if report_file is not set'''
+    if report_file:
+        with (contextlib.nullcontext(sys.stdout) if report_file == '-' else open(report_file, 'w')) as f:
+            json.dump(report, f, indent = 1)
+            f.write('\n')
+
+
+def restore_source(args):
     db = sources_db()
-    db.create()
+    if args.name is not None:
+        items = db.find_items(args.name)
+    else:
+        items = list(db.all_items())
+    if items:
+        plan = operation_plan(operation_plan.RESTORE)
+        for i in items: 
+            i.load_manifest(getattr(args, 'rescan', False))
+            i.plan_restore(plan, args.force)
+            if args.remove:
+                plan.add('unregister', id = i.get_id())
+        with db.batch():
+            run_plan(plan, db, args)
+
+
+def link_item(item, args):
+    '''create the links of a single item. return a summary dict: {"created" : int, "unchanged" : int, "skipped" : int, "failed" : int}'''
+    plan = operation_plan(operation_plan.LINKS)
+    item.load_manifest(getattr(args, 'rescan', False))
+    planned = item.plan_links(plan, getattr(args, 'target', None), args.force, getattr(args, 'reconcile', False))
+    executor = plan_executor()
+    executor.execute(plan, args.dryrun)
+    if args.dryrun:
+        created = len([op for op in plan.operations() if op['op'] == 'symlink'])
+    else:
+        created = executor.done['symlink']
+    return {'created' : created, 'unchanged' : planned['unchanged'], 'skipped' : planned['skipped'], 'failed' : executor.failed['symlink']}
 
 
 def set_links(args):
+    '''link all the selected items. items are handled in parallel by --jobs workers. return the summary of every item by its id'''
+    import concurrent.futures
     db = sources_db()
     if args.name is not None:
-        item = db.find_item(args.name)
-        if item:
+        items = db.find_items(args.name)
+    else:
+        items = list(db.all_items())
+    summary = dict()
+    if getattr(args, 'plan', None):
+        plan = operation_plan(operation_plan.LINKS)
+        for item in items:
             # link from required dest to local storage
-            item.create_all_links(None, args.force, args.dryrun)        
-            
+            item.load_manifest(getattr(args, 'rescan', False))
+            item.plan_links(plan, getattr(args, 'target', None), args.force, getattr(args, 'reconcile', False))
+        run_plan(plan, db, args)
     else:
-        for item in db.all_items():
-            item.create_all_links(None, args.force, args.dryrun)
+        jobs = max(1, getattr(args, 'jobs', 1) or 1)
+        if jobs == 1 or len(items) < 2:
+            results = [link_item(i, args) for i in items]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as pool:
+                results = list(pool.map(lambda i: link_item(i, args), items))
+        total = collections.Counter()
+        for item, result in zip(items, results):
+            summary[item.get_id()] = result
+            total.update(result)
+            logging.debug('{} - created: {created}, unchanged: {unchanged}, skipped: {skipped}, failed: {failed}'.format(item.get_id(), **result))
+        logging.info('{}{} items - created: {}, unchanged: {}, skipped: {}, failed: {}'.format('dryrun - ' if args.dryrun else '', len(items), total['created'], total['unchanged'], total['skipped'], total['failed']))
+    return summary
 
 
 def remove_source(args):
     db = sources_db()
     if args.name is not None:
-        db_item = db.find_item(args.name)
-        if db_item:
-            db_item.delete_created_links(args.dryrun)
-            db.remove_item(args.name, args.dryrun)
+        items = db.find_items(args.name)
+        if items:
+            plan = operation_plan(operation_plan.REMOVE)
+            for db_item in items:
+                db_item.load_manifest(getattr(args, 'rescan', False))
+                db_item.plan_delete_links(plan)
+                plan.add('unregister', id = db_item.get_id())
+            with db.batch():
+                run_plan(plan, db, args)
+
+
+def apply_plan(args):
+    plan = operation_plan.load(args.plan_file)
+    if plan is not None:
+        db = sources_db()
+        with db.batch():
+            plan_executor(db, args.jobs).execute(plan, args.dryrun)
+
+
+def verify(args):
+    '''
+    hash the stored files of the selected items in parallel, and compare them to the hashes recorded in their manifests.
+    return a report - a list of {"database id" : string, "file" : relative path, "problem" : string} where problem is one of:
+    "corrupt" - the content changed but the size and modification time did not (bit rot or tampering)
+    "modified" - the file changed since it was recorded (eg: edited through its link. run "update" to record it)
+    "missing", "unrecorded" (a stored file that is not in the manifest) or "unreadable"
+    the report is also written as json to args.report if it is set ("-" for stdout)
+    '''
+    import datetime, concurrent.futures
+    db = sources_db()
+    if getattr(args, 'name', None) is not None:
+        items = db.find_items(args.name)
+    else:
+        items = list(db.all_items())
+    since = None
+    if getattr(args, 'since', None):
+        since = int(datetime.datetime.fromisoformat(args.since).timestamp() * 1000000000)
+    report = list()
+    to_hash = list()
+    for item in items:
+        problems, files = item.files_to_verify(getattr(args, 'changed', False), since)
+        report.extend([{'database id' : item.get_id(), 'file' : f, 'problem' : p} for f, p in sorted(problems.items())])
+        to_hash.extend([(item, f, path, changed) for f, path, changed in files])
+
+    def hash_one(job):
+        try:
+            return file_hash(job[2])
+        except OSError:
+            return None
+    jobs = max(1, getattr(args, 'jobs', 1) or 1)
+    hashed = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as pool:
+        for (item, relative_path, path, changed), digest in zip(to_hash, pool.map(hash_one, to_hash)):
+            problem = None
+            record = item.load_manifest().files[relative_path]
+            if digest is None:
+                problem = 'unreadable'
+            elif record[3] is None:
+                # found by a rescan, never hashed. the current content is recorded
+                record[3] = digest
+                hashed[item.get_id()] = item
+            elif digest != record[3]:
+                problem = 'modified' if changed else 'corrupt'
+            if problem:
+                report.append({'database id' : item.get_id(), 'file' : relative_path, 'problem' : problem})
+    for item in hashed.values():
+        item.load_manifest().save()
+    for r in report:
+        logging.warning('{database id}: {file} - {problem}'.format(**r))
+    logging.info('verified {} files of {} items. {} problems found'.format(len(to_hash), len(items), len(report)))
+    write_report(report, getattr(args, 'report', None))
+    return report
+
+
+def status(args):
+    '''
+    report drift between the links of the selected items and their stored files (see db_item.status). items are checked in parallel.
+    return a report - a dict of the item status by database id. the report is also written as json to args.report if it is set ("-" for stdout)
+    '''
+    import concurrent.futures
+    db = sources_db()
+    if getattr(args, 'name', None) is not None:
+        items = db.find_items(args.name)
+    else:
+        items = list(db.all_items())
+    jobs = max(1, getattr(args, 'jobs', 1) or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as pool:
+        results = list(pool.map(lambda i: i.status(), items))
+    report = dict()
+    total = collections.Counter()
+    for item, result in zip(items, results):
+        report[item.get_id()] = result
+        counts = {k : (v if k == 'ok' else len(v)) for k, v in result.items()}
+        total.update(counts)
+        drift = ', '.join(['{}: {}'.format(k, v) for k, v in counts.items() if k != 'ok' and v > 0])
+        if drift:
+            logging.warning('{} - {}'.format(item.get_id(), drift))
+        item.record_link_health(counts['ok'], sum([counts[k] for k in ['missing', 'replaced', 'dangling', 'wrong target']]))
+    logging.info('{} items - {}'.format(len(items), ', '.join(['{}: {}'.format(k, total[k]) for k in ['ok', 'missing', 'replaced', 'dangling', 'wrong target', 'unmanaged']])))
+    write_report(report, getattr(args, 'report', None))
+    return report
+
+
+def resume(args):
+    '''finish (or roll back, with --rollback) every execution that was interrupted, using the journals left in the database folder'''
+    db = sources_db()
+    journals = operation_journal.find(db._db_folder_path)
+    if not journals:
+        logging.info('nothing to resume')
+    for journal in journals:
+        # locked while it is resumed, so another resume skips it
+        if not args.dryrun and not journal.reopen():
+            logging.info('{} belongs to a running command. skipped'.format(journal.path))
+            continue
+        plan, completed = journal.load()
+        logging.info('{} {} ({} of {} operations were completed)'.format('rolling back' if args.rollback else 'resuming', journal.path, len(completed), len(plan)))
+        if args.dryrun:
+            plan_executor(db).execute(plan, True)
+            continue
+        with db.batch():
+            executor = plan_executor(db, args.jobs)
+            if args.rollback:
+                executor.undo(plan)
+                db.on_batch_end(journal.remove)
+            else:
+                executor.execute(plan, False, journal, completed)
+
+
+# the fields of list_record, by verbosity
+LIST_FIELDS = ['name']
+LIST_VERBOSE_FIELDS = LIST_FIELDS + ['database id', 'original path']
+LIST_VERY_VERBOSE_FIELDS = LIST_VERBOSE_FIELDS + ['files', 'bytes', 'link health', 'links ok', 'links drifted', 'links since', 'last ingest']
+
+
+def list_record(item, verbose = False, very_verbose = False):
+    '''return a dict describing the item for list_sources. very_verbose fields come from the statistics cached in the database entry 
+    (see sources_db.record_stats) and the link health recorded by status (see db_item.record_link_health)'''
+    record = {'name' : item.get_id().split('_', maxsplit = 1)[1]}
+    if verbose or very_verbose:
+        record['database id'] = item.get_id()
+        record['original path'] = str(item.get_original_location())
+    if very_verbose:
+        stats = item.stats()
+        links = item.link_health()
+        record['files'] = stats.get('files')
+        record['bytes'] = stats.get('bytes')
+        record['link health'] = 'unknown' if links is None else 'drifted' if links['drifted'] else 'ok'
+        record['links ok'] = None if links is None else links['ok']
+        record['links drifted'] = None if links is None else links['drifted']
+        record['links since'] = None if links is None else links['since']
+        record['last ingest'] = stats.get('last ingest')
+    return record
 
 
 def list_sources(args):
+    '''
+    print the items of the database as they are read, without collecting them first.
+    args.format - text (default), json (a list), jsonl (an object per line) or csv (with a header line)
+    '''
     cellsize = 20
     db = sources_db()
-
-    for i in db.all_items():
-        id = i.get_id()
-        name = id.split('_')[1]
-        if args.veryverbose:
-            print('not supported yet')
+    output_format = getattr(args, 'format', None) or 'text'
+    very_verbose = getattr(args, 'very_verbose', False)
+    if output_format == 'json':
+        sys.stdout.write('[')
+    elif output_format == 'csv':
+        import csv
+        writer = csv.DictWriter(sys.stdout, fieldnames = LIST_VERY_VERBOSE_FIELDS if very_verbose else LIST_VERBOSE_FIELDS if args.verbose else LIST_FIELDS)
+        writer.writeheader()
+
+    for n, i in enumerate(db.all_items()):
+        record = list_record(i, args.verbose, very_verbose)
+        if output_format == 'json':
+            sys.stdout.write((',\n' if n else '\n') + json.dumps(record))
+        elif output_format == 'jsonl':
+            sys.stdout.write(json.dumps(record) + '\n')
+        elif output_format == 'csv':
+            writer.writerow(record)
+        elif very_verbose:
+            size = '-' if record['bytes'] is None else str(record['bytes'])
+            files = '-' if record['files'] is None else str(record['files'])
+            print('  '.join([record['name'].ljust(cellsize), record['database id'].ljust(cellsize + 20), files.rjust(8), size.rjust(12), 
+                record['link health'].ljust(8), record['last ingest'] or '-']))
         elif args.verbose:
-            print(name + ' '*(cellsize - len(name)+2) + id)
+            print(record['name'] + ' '*(cellsize - len(record['name'])+2) + record['database id'])
         else:
-            print(i.get_id().split('_')[1])
+            print(record['name'])
+    if output_format == 'json':
+        sys.stdout.write('\n]\n')
 
 
 def update(args):
-    #TODO:
-    logging.critical('Not implement yet')
+    if args.extensions is not None:
+        args.extensions = [os_case(e) for e in args.extensions]
+    db = sources_db()
+    item = db.find_item(args.name)
+    if item:
+        if args.extensions is not None:
+            item = db_item(item._db_entry_data, item._database_path, args.extensions)
+        item.update(args.dryrun, getattr(args, 'jobs', 1))
+        if not args.dryrun:
+            db.record_stats(item, True)
+
+
+class inotify_watcher():
+    '''
+    linux inotify through ctypes. watches directories, and returns (directory, name, is_dir, complete) for every created, written or moved in entry.
+    complete is False while a file may still be written (created or modified, but not closed yet)
+    '''
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT_HEADER = 16
+
+    def __init__(self):
+        import ctypes, ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = dict()
+
+
+    def add(self, dir_path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), self.MASK)
+        if wd < 0:
+            logging.error('couldnt watch {} ({})'.format(dir_path, os.strerror(self._ctypes.get_errno())))
+        else:
+            self._watches[wd] = dir_path
+        return wd >= 0
+
+
+    def read(self, timeout):
+        '''wait up to timeout seconds for events. return a list of (directory, name, is_dir, complete). 
+        if events were lost (queue overflow) (None, None, True, True) is returned'''
+        import select, struct
+        events = list()
+        if select.select([self._fd], [], [], timeout)[0]:
+            try:
+                data = os.read(self._fd, 1024 * 64)
+            except BlockingIOError:
+                data = b''
+            offset = 0
+            while offset + self.EVENT_HEADER <= len(data):
+                wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + self.EVENT_HEADER : offset + self.EVENT_HEADER + length].rstrip(b'\0')
+                offset += self.EVENT_HEADER + length
+                if mask & self.IN_Q_OVERFLOW:
+                    events.append((None, None, True, True))
+                elif mask & self.IN_IGNORED:
+                    self._watches.pop(wd, None)
+                elif wd in self._watches and name:
+                    events.append((self._watches[wd], os.fsdecode(name), bool(mask & self.IN_ISDIR), bool(mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO))))
+        return events
+
+
+    def close(self):
+        os.close(self._fd)
+
+
+class source_watcher():
+    '''
+    watch the original locations of database items, and take over new or changed files as they appear (see db_item.update).
+    events are collected until there are none for 'debounce' seconds, and then the files of every item are taken over together.
+    linux inotify is used when available, otherwise the locations are scanned every 'interval' seconds.
+    items with directory links are not watched - new files are written into the database through the link
+    '''
+
+    def __init__(self, items, debounce = 1.0, interval = 5.0, use_inotify = True, dryrun = False, db = None):
+        self._items = [i for i in items if not i.has_directory_links()]
+        # the statistics of taken over items are recorded in db, if it is set
+        self._db = db
+        self._debounce = debounce
+        self._interval = interval
+        self._dryrun = dryrun
+        self._pending = dict()
+        self._last_event = 0
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = inotify_watcher()
+            except (OSError, AttributeError) as e:
+                logging.info('inotify is not available ({}). polling every {} seconds'.format(e, interval))
+        self._snapshots = dict()
+        for item in self._items:
+            if self._inotify is not None:
+                self._watch_tree(item, self._root(item))
+            else:
+                self._snapshots[item.get_id()] = self._snapshot(item)
+
+
+    @staticmethod
+    def _root(item):
+        root = item.get_original_location()
+        return os.path.dirname(root) if item.is_file() else root
+
+
+    def _watch_tree(self, item, dir_path):
+        '''watch dir_path and all its sub directories that are not excluded by the item filters'''
+        root = self._root(item)
+        stack = [dir_path]
+        while stack:
+            current = stack.pop()
+            self._inotify.add(current)
+            if item.is_file():
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        relative_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        if entry.is_dir(follow_symlinks = False) and not item._path_filter.dir_excluded(relative_path):
+                            stack.append(entry.path)
+            except OSError:
+                logging.error('couldnt read directory {}'.format(current))
+
+
+    def _snapshot(self, item):
+        '''return {path : (size, mtime_ns)} of the files of the item that could be taken over'''
+        snapshot = dict()
+        for f in item._original_files():
+            if not f.is_symlink:
+                try:
+                    st = os.stat(f.path)
+                    snapshot[f.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+        return snapshot
+
+
+    def _item_for(self, path):
+        '''return the item that owns path. a file item owns only its file, otherwise the directory item with the longest root containing path'''
+        found = None
+        for item in self._items:
+            if item.is_file():
+                if path == item.get_original_location():
+                    return item
+                continue
+            root = self._root(item)
+            if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and (found is None or len(root) > len(self._root(found))):
+                found = item
+        return found
+
+
+    def _add_pending(self, item, paths):
+        if paths:
+            self._pending.setdefault(item.get_id(), (item, set()))[1].update(paths)
+            self._last_event = time.monotonic()
+
+
+    def _collect(self, timeout):
+        '''wait up to timeout seconds for changes, and add them to the pending files'''
+        if self._inotify is not None:
+            for dir_path, name, is_dir, complete in self._inotify.read(timeout):
+                if dir_path is None:
+                    logging.warning('events were lost. scanning all the watched locations')
+                    for item in self._items:
+                        self._add_pending(item, [f.path for f in item._original_files() if not f.is_symlink])
+                    continue
+                path = os.path.join(dir_path, name)
+                item = self._item_for(path)
+                if item is None:
+                    continue
+                if is_dir:
+                    # a new directory. watch it, and take over the files that were created in it before the watch
+                    self._watch_tree(item, path)
+                    self._add_pending(item, [f.path for f in walk_files(path)])
+                elif complete:
+                    self._add_pending(item, [path])
+                else:
+                    # the file is being written. it is taken over only after it is closed, and the debounce restarts
+                    pending = self._pending.get(item.get_id())
+                    if pending is not None:
+                        pending[1].discard(path)
+                    self._last_event = time.monotonic()
+        else:
+            time.sleep(timeout)
+            for item in self._items:
+                snapshot = self._snapshot(item)
+                previous = self._snapshots.get(item.get_id(), dict())
+                self._add_pending(item, [p for p, st in snapshot.items() if previous.get(p) != st])
+                self._snapshots[item.get_id()] = snapshot
+
+
+    def process_pending(self):
+        '''take over the pending files of every item. return the number of files taken over'''
+        taken = 0
+        pending = self._pending
+        self._pending = dict()
+        for item, paths in pending.values():
+            records = item.records_for(paths)
+            if records:
+                logging.info('{}: taking over {} files'.format(item.get_id(), len(records)))
+                item.update(self._dryrun, 1, records)
+                if self._db is not None and not self._dryrun:
+                    self._db.record_stats(item, True)
+                taken += len(records)
+                if self._inotify is None:
+                    # the taken over files are links now
+                    self._snapshots[item.get_id()] = self._snapshot(item)
+        return taken
+
+
+    def run(self, stop = None):
+        '''watch until stop (a threading.Event) is set, or forever'''
+        logging.info('watching {} sources'.format(len(self._items)))
+        try:
+            while stop is None or not stop.is_set():
+                timeout = self._debounce if self._pending else (0.5 if self._inotify is not None else self._interval)
+                if self._inotify is None:
+                    timeout = min(timeout, self._interval)
+                self._collect(timeout)
+                if self._pending and time.monotonic() - self._last_event >= self._debounce:
+                    self.process_pending()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+
+def watch(args):
+    db = sources_db()
+    if getattr(args, 'name', None) is not None:
+        items = db.find_items(args.name)
+    else:
+        items = list(db.all_items())
+    watcher = source_watcher(items, args.debounce, args.interval, not args.poll, args.dryrun, db)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+class resident_server():
+    '''
+    serves commands over a unix socket in the database folder, keeping the database (with its name index) and the item manifests 
+    in memory between commands. while it runs, the command line sends its commands to the server instead of running them (see handle_args).
+    a request is a json line: {"argv" : [command line arguments]}
+    the response is a json line: {"stdout" : string, "stderr" : string, "log" : [[level, message], ...], "exit" : int}
+    '''
+    SOCKET_NAME = 'takeover.sock'
+    # commands that always run in the calling process
+    LOCAL_COMMANDS = ('serve', 'watch', 'init', 'migrate')
+
+    def __init__(self, db_folder_path):
+        self._db_folder_path = pathlib.Path(db_folder_path)
+        self.socket_path = str(self._db_folder_path / self.SOCKET_NAME)
+
+
+    def _listen(self):
+        import socket
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                probe.close()
+                raise RuntimeError('a server is already running on {}'.format(self.socket_path))
+            except OSError:
+                # left by a server that didnt exit cleanly
+                os.remove(self.socket_path)
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server_socket.listen()
+        server_socket.settimeout(0.5)
+        return server_socket
+
+
+    def serve_forever(self, stop = None):
+        '''serve until stop (a threading.Event) is set, or forever'''
+        import socket
+        db = sources_db(self._db_folder_path)
+        if not db.load():
+            logging.error('couldnt load the database. use the "init" command to create one')
+            return
+        server_socket = self._listen()
+        sources_db.resident_backends[str(self._db_folder_path)] = db._backend
+        item_manifest.cache = dict()
+        logging.info('serving {}'.format(self.socket_path))
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    connection, _ = server_socket.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    connection.settimeout(None)
+                    self._handle(connection)
+        finally:
+            server_socket.close()
+            os.remove(self.socket_path)
+            sources_db.resident_backends.pop(str(self._db_folder_path), None)
+            item_manifest.cache = None
+
+
+    def _refresh(self):
+        '''reopen the database if it was changed by another process (eg: migrated)'''
+        backend = sources_db.resident_backends[str(self._db_folder_path)]
+        if not backend.exists():
+            backend = open_backend(self._db_folder_path)
+            sources_db.resident_backends[str(self._db_folder_path)] = backend
+        backend.refresh()
+
+
+    def _handle(self, connection):
+        import io
+        response = {'stdout' : '', 'stderr' : '', 'log' : list(), 'exit' : 0}
+        capture = log_capture()
+        root_logger = logging.getLogger()
+        root_logger.addHandler(capture)
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        try:
+            request = json.loads(connection.makefile('rb').readline())
+            self._refresh()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                args = parse_args(request['argv'])
+                args.func(args)
+        except SystemExit as e:
+            response['exit'] = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except Exception:
+            logging.exception('command failed')
+            response['exit'] = 1
+        finally:
+            root_logger.removeHandler(capture)
+        response['stdout'] = stdout.getvalue()
+        response['stderr'] = stderr.getvalue()
+        response['log'] = capture.records
+        try:
+            connection.sendall(json.dumps(response).encode() + b'\n')
+        except OSError:
+            logging.error('couldnt send the response')
+
+
+    @classmethod
+    def forward(cls, argv):
+        '''
+        run the command on the server of the database in the current directory. return the command exit code, or None if it wasnt sent.
+        set TAKEOVER_NO_SERVER in the environment to always run commands locally
+        '''
+        socket_path = os.path.join(os.getcwd(), cls.SOCKET_NAME)
+        reads_stdin = any([a == '-' and i > 0 and argv[i - 1] == '--from-file' for i, a in enumerate(argv)]) or '--from-file=-' in argv
+        if not argv or argv[0] in cls.LOCAL_COMMANDS or reads_stdin or os.environ.get('TAKEOVER_NO_SERVER') or not os.path.exists(socket_path):
+            return None
+        import socket
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(socket_path)
+        except OSError:
+            client.close()
+            return None
+        with client:
+            client.sendall(json.dumps({'argv' : argv}).encode() + b'\n')
+            response = json.loads(client.makefile('rb').readline())
+        for level, message in response['log']:
+            logging.log(level, message)
+        sys.stdout.write(response['stdout'])
+        sys.stderr.write(response['stderr'])
+        return response['exit']
+
+
+class log_capture(logging.Handler):
+    '''keeps the (level, message) of every record'''
+    def __init__(self):
+        super().__init__()
+        self.records = list()
+
+
+    def emit(self, record):
+        self.records.append([record.levelno, record.getMessage()])
+
+
+def serve(args):
+    import signal
+    # stop cleanly (removing the socket) when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        resident_server(os.getcwd()).serve_forever()
+    except KeyboardInterrupt:
+        pass
 
 
 def init(args):
     db = sources_db()
-    db.create()
+    db.create(getattr(args, 'backend', None))
+
+
+def migrate(args):
+    db = sources_db()
+    if db.migrate(args.to):
+        logging.info('database migrated to {}'.format(args.to))
+
+
+# the commands of the command line (see build_parser)
+COMMANDS = ('init', 'migrate', 'takeover', 'set_links', 'restore_source', 'remove_source', 'update', 'apply', 'verify', 'status', 'resume', 'watch', 'serve', 'list')
+
 
+def build_parser(command = None):
+    '''
+    return the command line parser. if command is set, only the parser of that command is created (the others are not needed to run it).
+    '''
+    wanted = lambda name: command is None or command == name
 
-def handle_args():
     # create the top-level parser
     msg = '''This program is used to take over files (usually config files), 
     manage them in a single location and replace original files with links'''
@@ -630,57 +3683,158 @@ def handle_args():
     subparsers = parser.add_subparsers(title = 'Allowed commands', help = 'Try "take_over COMMAND -h"')
     
     # create the parser for the "init" command
-    parser_init = subparsers.add_parser('init', description = 'initialize a database in the current directory')
-    parser_init.set_defaults(func = init)
+    if wanted('init'):
+        parser_init = subparsers.add_parser('init', description = 'initialize a database in the current directory')
+        parser_init.add_argument('-b', '--backend', choices = list(backends), default = None, help = 'How to store the database. json by default')
+        parser_init.set_defaults(func = init)
+
+    # create the parser for the "migrate" command
+    if wanted('migrate'):
+        parser_migrate = subparsers.add_parser('migrate', description = 'Move the database in the current directory to another backend')
+        parser_migrate.add_argument('to', choices = list(backends), help = 'The backend to move the database to')
+        parser_migrate.set_defaults(func = migrate)
 
     # create the parser for the "takeover" command
-    parser_takeover = subparsers.add_parser('takeover', description = 'Takeover a file or folder, and store them localy as a source.')
-    parser_takeover.add_argument('path', help = 'Path to file or folder to takeover')
-    parser_takeover.add_argument('-t', '--target', default = None, help = 'A default path for the link to point to. If not set, original (local) path will be used')
-    parser_takeover.add_argument('-e', '--extensions', nargs = '+', default = None, help = 'A list of file extensions to take over. If not set all files are taken ove eg: -t xml ini')
-    parser_takeover.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
-    parser_takeover.set_defaults(func = take_over)
+    if wanted('takeover'):
+        parser_takeover = subparsers.add_parser('takeover', description = 'Takeover a file or folder, and store them localy as a source.')
+        parser_takeover.add_argument('path', nargs = '*', help = 'Paths to files or folders to takeover')
+        parser_takeover.add_argument('--from-file', default = None, help = 'A file with a path to take over in every line ("-" to read the paths from stdin)')
+        parser_takeover.add_argument('--report', metavar = 'REPORT_FILE', default = None, help = 'Write the result of every path as json to REPORT_FILE ("-" for stdout)')
+        parser_takeover.add_argument('-t', '--target', default = None, help = 'A default path for the link to point to. If not set, original (local) path will be used')
+        parser_takeover.add_argument('-e', '--extensions', nargs = '+', default = None, help = 'A list of file extensions to take over. If not set all files are taken ove eg: -t xml ini')
+        parser_takeover.add_argument('-i', '--include', nargs = '+', default = None, help = 'Glob patterns of files to take over eg: -i "*.conf" "conf.d/*". Added to the "!" lines of the .takeoverignore file in PATH')
+        parser_takeover.add_argument('-x', '--exclude', nargs = '+', default = None, help = 'Glob patterns of files and directories not to take over eg: -x .git node_modules "*.tmp". Added to the lines of the .takeoverignore file in PATH')
+        parser_takeover.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_takeover.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of paths (or files, for a single path) to copy in parallel')
+        parser_takeover.add_argument('-m', '--move', action = 'store_true', default = False, help = 'Move the files into the database instead of copying them, when both are on the same file system')
+        parser_takeover.add_argument('--dedup', action = 'store_true', default = False, help = 'Store identical files only once in the database. Files with the same content share storage, so editing one in place changes all of them')
+        parser_takeover.add_argument('-r', '--relative', action = 'store_true', default = False, help = 'Links point to the database with a relative path, so the database can be moved together with the links without linking again. --target is not used for the links')
+        parser_takeover.add_argument('--dir-links', action = 'store_true', default = False, help = 'Link whole directories instead of every file, where the directory holds only taken over files. Not used with --extensions, --include or --exclude')
+        parser_takeover.add_argument('-p', '--plan', metavar = 'PLAN_FILE', default = None, help = 'Save the planned operations to PLAN_FILE instead of executing them (see the "apply" command)')
+        parser_takeover.set_defaults(func = take_over)
     
+
     # create the parser for the "set_links" command
-    parser_set_links = subparsers.add_parser('set_links', description = 'Set links for the managed sources')
-    parser_set_links.add_argument('-n', '--name', default = None, help = 'Name of database source to use (see "list" command). If not set, all sources will be used')
-    parser_set_links.add_argument('-t', '--target', default = None, help = 'Path for the link to point to. If not set, the default path will be used')
-    #TODO: parser_set_links.add_argument('-l', '--link-path', default = None, help = 'Base path for where to put the links. If not set, the default (original path) path will be used')
-    parser_set_links.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
-    parser_set_links.add_argument('-f', '--force', action = 'store_true', default = False, help = 'New links will remove existing file or links')
-    parser_set_links.set_defaults(func = set_links)
+    if wanted('set_links'):
+        parser_set_links = subparsers.add_parser('set_links', description = 'Set links for the managed sources')
+        parser_set_links.add_argument('-n', '--name', default = None, help = 'Name of database source to use (see "list" command). Wildcards select several sources eg: "nginx*". If not set, all sources will be used')
+        parser_set_links.add_argument('-t', '--target', default = None, help = 'Path for the link to point to. If not set, the default path will be used')
+        #TODO: parser_set_links.add_argument('-l', '--link-path', default = None, help = 'Base path for where to put the links. If not set, the default (original path) path will be used')
+        parser_set_links.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_set_links.add_argument('-f', '--force', action = 'store_true', default = False, help = 'New links will remove existing file or links')
+        parser_set_links.add_argument('-r', '--reconcile', action = 'store_true', default = False, help = 'Leave links that already point to the right file untouched, and fix missing or wrong links only')
+        parser_set_links.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of items to link in parallel')
+        parser_set_links.add_argument('--rescan', action = 'store_true', default = False, help = 'Rebuild the list of stored files of the source from the database folder')
+        parser_set_links.add_argument('-p', '--plan', metavar = 'PLAN_FILE', default = None, help = 'Save the planned operations to PLAN_FILE instead of executing them (see the "apply" command)')
+        parser_set_links.set_defaults(func = set_links)
 
     # create the parser for the "restore" command
-    parser_restore = subparsers.add_parser('restore_source', description = 'Remove created links, and copy the source back to its original path')
-    parser_restore.add_argument('-n', '--name', default = None, help = 'Name of source to use (see "list" command). If not set, all sources will be used')
-    parser_restore.add_argument('-r', '--remove', action = 'store_true', default = False, help = 'If set, the source will be forgotten. It will be removed from the database, and will no longer be managed')
-    parser_restore.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
-    parser_restore.add_argument('-f', '--force', action = 'store_true', default = False, help = 'Restored files will remove existing file or links')
-    parser_restore.set_defaults(func = restore_source)
+    if wanted('restore_source'):
+        parser_restore = subparsers.add_parser('restore_source', description = 'Remove created links, and copy the source back to its original path')
+        parser_restore.add_argument('-n', '--name', default = None, help = 'Name of source to use (see "list" command). Wildcards select several sources eg: "nginx*". If not set, all sources will be used')
+        parser_restore.add_argument('-r', '--remove', action = 'store_true', default = False, help = 'If set, the source will be forgotten. It will be removed from the database, and will no longer be managed')
+        parser_restore.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_restore.add_argument('-f', '--force', action = 'store_true', default = False, help = 'Restored files will remove existing file or links')
+        parser_restore.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of files to copy in parallel')
+        parser_restore.add_argument('--rescan', action = 'store_true', default = False, help = 'Rebuild the list of stored files of the source from the database folder')
+        parser_restore.add_argument('-p', '--plan', metavar = 'PLAN_FILE', default = None, help = 'Save the planned operations to PLAN_FILE instead of executing them (see the "apply" command)')
+        parser_restore.set_defaults(func = restore_source)
 
     # create the parser for the "remove" command - remove entry from database
-    parser_remove = subparsers.add_parser('remove_source', description = 'Remove a source from database')
-    parser_remove.add_argument('-n', '--name', required = True, default = None, help = 'Name of source to use (see "list" command).')
-    parser_remove.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
-    parser_remove.set_defaults(func = remove_source)
+    if wanted('remove_source'):
+        parser_remove = subparsers.add_parser('remove_source', description = 'Remove a source from database')
+        parser_remove.add_argument('-n', '--name', required = True, default = None, help = 'Name of source to use (see "list" command). Wildcards select several sources eg: "nginx*"')
+        parser_remove.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_remove.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of directories to handle in parallel')
+        parser_remove.add_argument('--rescan', action = 'store_true', default = False, help = 'Rebuild the list of stored files of the source from the database folder')
+        parser_remove.add_argument('-p', '--plan', metavar = 'PLAN_FILE', default = None, help = 'Save the planned operations to PLAN_FILE instead of executing them (see the "apply" command)')
+        parser_remove.set_defaults(func = remove_source)
 
     # create the parser for the "update" command - update database entry with newly created files
-    parser_update = subparsers.add_parser('update', description = 'update database items')
-    parser_update.add_argument('-n', '--name', required = True, default = None, help = 'Name of source to use (see "list" command).')
-    parser_update.add_argument('-e', '--extensions', nargs = '+', default = None, help = 'A list of file extensions to to consider when updating. If not set all files are considered eg: -t xml ini')
-    parser_update.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
-    parser_update.set_defaults(func = update)
+    if wanted('update'):
+        parser_update = subparsers.add_parser('update', description = 'update database items')
+        parser_update.add_argument('-n', '--name', required = True, default = None, help = 'Name of source to use (see "list" command).')
+        parser_update.add_argument('-e', '--extensions', nargs = '+', default = None, help = 'A list of file extensions to to consider when updating. If not set all files are considered eg: -t xml ini')
+        parser_update.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_update.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of files to copy in parallel')
+        parser_update.set_defaults(func = update)
+
+    # create the parser for the "apply" command
+    if wanted('apply'):
+        parser_apply = subparsers.add_parser('apply', description = 'Execute a plan saved with the --plan option of another command, without scanning the file system again')
+        parser_apply.add_argument('plan_file', help = 'The plan file to execute')
+        parser_apply.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_apply.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of operations to execute in parallel')
+        parser_apply.set_defaults(func = apply_plan)
+
+    # create the parser for the "verify" command
+    if wanted('verify'):
+        parser_verify = subparsers.add_parser('verify', description = 'Check the stored files against the hashes recorded when they were taken over')
+        parser_verify.add_argument('-n', '--name', default = None, help = 'Name of database source to verify (see "list" command). Wildcards select several sources eg: "nginx*". If not set, all sources will be verified')
+        parser_verify.add_argument('-c', '--changed', action = 'store_true', default = False, help = 'Only hash files whose size or modification time changed since they were recorded')
+        parser_verify.add_argument('-s', '--since', default = None, help = 'Only hash files modified after this time (ISO format eg: 2020-01-31T22:00)')
+        parser_verify.add_argument('-j', '--jobs', type = int, default = 4, help = 'Number of files to hash in parallel')
+        parser_verify.add_argument('--report', metavar = 'REPORT_FILE', default = None, help = 'Write the problems as json to REPORT_FILE ("-" for stdout)')
+        parser_verify.set_defaults(func = verify)
+
+    # create the parser for the "status" command
+    if wanted('status'):
+        parser_status = subparsers.add_parser('status', description = 'Show links that drifted from the database: missing, replaced by a file, dangling or pointing elsewhere, and new files that are not managed')
+        parser_status.add_argument('-n', '--name', default = None, help = 'Name of database source to check (see "list" command). Wildcards select several sources eg: "nginx*". If not set, all sources will be checked')
+        parser_status.add_argument('-j', '--jobs', type = int, default = 4, help = 'Number of sources to check in parallel')
+        parser_status.add_argument('--report', metavar = 'REPORT_FILE', default = None, help = 'Write the status of every source as json to REPORT_FILE ("-" for stdout)')
+        parser_status.set_defaults(func = status)
+
+    # create the parser for the "resume" command
+    if wanted('resume'):
+        parser_resume = subparsers.add_parser('resume', description = 'Complete (or roll back) commands that were interrupted, eg: by a crash or a power failure')
+        parser_resume.add_argument('-r', '--rollback', action = 'store_true', default = False, help = 'Roll back an interrupted take over instead of completing it')
+        parser_resume.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_resume.add_argument('-j', '--jobs', type = int, default = 1, help = 'Number of operations to execute in parallel')
+        parser_resume.set_defaults(func = resume)
+
+    # create the parser for the "watch" command
+    if wanted('watch'):
+        parser_watch = subparsers.add_parser('watch', description = 'Keep watching the sources, and take over new or changed files as they appear')
+        parser_watch.add_argument('-n', '--name', default = None, help = 'Name of database source to watch (see "list" command). Wildcards select several sources eg: "nginx*". If not set, all sources will be watched')
+        parser_watch.add_argument('--debounce', type = float, default = 1.0, help = 'Seconds without changes to wait before taking over the changed files')
+        parser_watch.add_argument('--interval', type = float, default = 5.0, help = 'Seconds between scans, when polling')
+        parser_watch.add_argument('--poll', action = 'store_true', default = False, help = 'Scan the sources periodically instead of using inotify')
+        parser_watch.add_argument('-d', '--dryrun', action = 'store_true', default = False, help = 'Actions will only be printed out. There will be no effect on the file system')
+        parser_watch.set_defaults(func = watch)
+
+    # create the parser for the "serve" command
+    if wanted('serve'):
+        parser_serve = subparsers.add_parser('serve', description = 'Keep the database in memory and serve the commands of the current directory database over a unix socket. while it runs, commands are sent to it automatically')
+        parser_serve.set_defaults(func = serve)
 
     # create the parser for the "list" command
-    parser_list = subparsers.add_parser('list', description = 'List the managed files and folders')
-    parser_list.add_argument('-v', '--verbose', action = 'store_true', default = False, help = 'print more details')
-    parser_list.add_argument('--very_verbose', action = 'store_true', default = False, help = 'print even more details')
-    parser_list.set_defaults(func = list_sources)
+    if wanted('list'):
+        parser_list = subparsers.add_parser('list', description = 'List the managed files and folders')
+        parser_list.add_argument('-v', '--verbose', action = 'store_true', default = False, help = 'print more details')
+        parser_list.add_argument('--very_verbose', '-vv', action = 'store_true', default = False, help = 'print even more details: stored files, size, link health (as found by the last "status" command) and last take over time of every source')
+        parser_list.add_argument('-f', '--format', choices = ['text', 'json', 'jsonl', 'csv'], default = 'text', help = 'Output format. json and csv are printed as the sources are read')
+        parser_list.set_defaults(func = list_sources)
 
     #if system.platform != "win32":
         #logging.debug('A linux machine detected. This is not yet supported')
         #parser.error('Currently only windows is supported')
-    args = parser.parse_args()
+    return parser
+
+
+def parse_args(argv):
+    '''parse the command line arguments, building the parser of the given command only'''
+    command = argv[0] if argv and argv[0] in COMMANDS else None
+    return build_parser(command).parse_args(argv)
+
+
+def handle_args(argv = None):
+    '''run the command line. when a server is running for the database in the current directory, the command is sent to it'''
+    argv = sys.argv[1:] if argv is None else argv
+    exit_code = resident_server.forward(argv)
+    if exit_code is not None:
+        sys.exit(exit_code)
+    args = parse_args(argv)
     args.func(args)
 
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''
+startup time benchmark: the wall time of "python take_over.py list" on a large database.
+creates a temporary database with --items sources (without files), runs the command --runs times,
+and appends the results to bench_output.txt (next to this script).
+run: python take_over_bench.py [--items 10000] [--runs 10] [--backend json]
+'''
+
+import argparse
+import datetime
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import take_over
+
+
+def create_db(db_folder_path, items, backend_name):
+    backend = take_over.open_backend(db_folder_path, backend_name)
+    backend.create()
+    backend.load()
+    entries = list()
+    for i in range(items):
+        name = 'source{}'.format(i)
+        path = str(pathlib.Path(db_folder_path).parent / 'sources' / name)
+        entries.append({'name' : name, 'database id' : '20200101000000{:06}_{}'.format(i, name), 'is file' : False,
+            'original path' : path, 'default database path' : str(db_folder_path), 'symlink path' : path, 'extensions' : None,
+            'deduplicated' : False, 'directory links' : False, 'relative links' : False, 'include' : None, 'exclude' : None})
+    backend.import_entries(entries)
+
+
+def time_command(db_folder_path, command, runs):
+    '''return the wall time (seconds) of every run of the command'''
+    env = dict(os.environ, TAKEOVER_NO_SERVER = '1')
+    times = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, take_over.__file__] + command, cwd = str(db_folder_path), env = env, check = True,
+            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure the wall time of "take_over.py list" on a large database')
+    parser.add_argument('--items', type = int, default = 10000, help = 'Number of sources in the database')
+    parser.add_argument('--runs', type = int, default = 10, help = 'Number of times to run every command')
+    parser.add_argument('--backend', choices = list(take_over.backends), default = 'json', help = 'The database backend')
+    args = parser.parse_args()
+
+    results = list()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_folder_path = pathlib.Path(temp_dir) / 'db'
+        db_folder_path.mkdir()
+        create_db(db_folder_path, args.items, args.backend)
+        for command in (['--version'], ['list']):
+            times = time_command(db_folder_path, command, args.runs)
+            results.append('{} {} items={} backend={} min={:.3f}s median={:.3f}s'.format(datetime.datetime.now().isoformat(timespec = 'seconds'),
+                ' '.join(command), args.items, args.backend, min(times), statistics.median(times)))
+
+    with open(pathlib.Path(__file__).parent / 'bench_output.txt', 'a') as output:
+        for line in results:
+            print(line)
+            output.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
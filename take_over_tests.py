@@ -5,6 +5,13 @@ import shutil
 import json
 import platform
 import logging
+import threading
+import time
+import io
+import contextlib
+import subprocess
+import sys
+import unittest.mock
 import take_over
 
 
@@ -150,6 +157,37 @@ class Test_take_over(BaseTestCase):
         self.assertEqual(len(list(self.get_single_item_db_path().iterdir())), 1)
 
 
+    def test_parallel_copy(self):
+        '''takeover using several copy jobs'''
+        self.takeover_args.jobs = 4
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        file_count = 0
+        for root, dirs, files in os.walk(self.files_dir):
+            for file in files:
+                i = pathlib.Path(root) / file
+                self.assertTrue(i.is_symlink())
+                self.assertTrue(i.resolve().exists())
+                file_count += 1
+        self.assertEqual(file_count, self.FILES_NUM * (self.DIRS_NUM + 1))
+        db_file_count = sum([len(files) for root, dirs, files in os.walk(self.get_single_item_db_path())])
+        self.assertEqual(db_file_count, self.FILES_NUM * (self.DIRS_NUM + 1))
+
+
+    def test_move(self):
+        '''takeover with move - files are renamed into the database instead of copied'''
+        inodes = {f.relative_to(self.files_dir) : f.stat().st_ino for f in self.setup_created_files}
+        self.takeover_args.move = True
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        db_item_path = self.get_single_item_db_path()
+        for relative_path, inode in inodes.items():
+            link = self.files_dir / relative_path
+            self.assertTrue(link.is_symlink())
+            # same inode means the file was moved, not copied
+            self.assertEqual((db_item_path / relative_path).stat().st_ino, inode)
+
+
     @unittest.skip('Not implemented yet')
     def test_mixed_dir_and_file_take_over(self):
         ''' takeover both files and folders with mixed and overlapping locations'''
@@ -198,6 +236,276 @@ class Test_take_over(BaseTestCase):
             self.assertFalse(True, 'curently test is only implemented for linux')
 
 
+class Test_bulk_take_over(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        self.items = [str(self.files_dir / 'files_{}'.format(d)) for d in range(self.DIRS_NUM)]
+
+
+    def test_many_paths(self):
+        '''paths are taken over in parallel, the database is written once and every path is reported'''
+        saves = list()
+        original_save = take_over.json_backend.save
+        take_over.json_backend.save = lambda backend: saves.append(1) or original_save(backend)
+        try:
+            self.takeover_args.path = self.items + [str(self.files_dir / 'missing')]
+            self.takeover_args.jobs = 4
+            self.takeover_args.report = str(self.cwd / 'report.json')
+            report = take_over.take_over(self.takeover_args)
+        finally:
+            take_over.json_backend.save = original_save
+        self.assertEqual(len(saves), 1)
+        self.assertEqual([r['status'] for r in report], ['taken over'] * self.DIRS_NUM + ['skipped'])
+        self.assertEqual([r['files'] for r in report], [self.FILES_NUM] * self.DIRS_NUM + [0])
+        with open(self.cwd / 'report.json', 'r') as f:
+            self.assertEqual(json.load(f), report)
+        with open(self.db_file_name, 'r') as f:
+            self.assertEqual(sorted(json.load(f)), sorted([r['database id'] for r in report[:-1]]))
+        for item in self.items:
+            for f in pathlib.Path(item).iterdir():
+                self.assertTrue(f.is_symlink())
+                self.assertTrue(f.resolve().exists())
+
+
+    def test_from_file(self):
+        '''paths are read from a file, one per line'''
+        paths_file = self.cwd / 'paths.txt'
+        with open(paths_file, 'w') as f:
+            f.write('# items\n' + '\n'.join(self.items[:3]) + '\n\n')
+        self.takeover_args.path = []
+        self.takeover_args.from_file = str(paths_file)
+        report = take_over.take_over(self.takeover_args)
+        self.assertEqual([r['path'] for r in report], self.items[:3])
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 3)
+
+
+class Test_walk_files(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def test_all_files(self):
+        '''all files are found with their relative paths'''
+        records = list(take_over.walk_files(self.files_dir))
+        self.assertEqual(len(records), len(self.setup_created_files))
+        for r in records:
+            self.assertEqual(pathlib.Path(r.path), self.files_dir / r.relative_path)
+            self.assertEqual(r.name, pathlib.Path(r.path).name)
+            self.assertFalse(r.is_symlink)
+
+
+    def test_suffixes_and_symlinks(self):
+        '''suffix filter is applied, file symlinks are returned and directory symlinks are not followed'''
+        (self.files_dir / 'file.ini').touch()
+        (self.files_dir / 'link.ini').symlink_to(self.files_dir / 'file.ini')
+        (self.files_dir / 'dir_link').symlink_to(self.files_dir / 'files_1')
+        records = {r.relative_path : r for r in take_over.walk_files(self.files_dir, ['.ini'])}
+        self.assertEqual(set(records), {'file.ini', 'link.ini'})
+        self.assertTrue(records['link.ini'].is_symlink)
+        self.assertFalse(records['file.ini'].is_symlink)
+        all_records = [r.relative_path for r in take_over.walk_files(self.files_dir)]
+        self.assertFalse(any([r.startswith('dir_link') for r in all_records]))
+
+
+class Test_fast_copy(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def test_content_and_metadata(self):
+        '''the copy has the same content, mode and modification time as the source, whatever strategy is used'''
+        src = self.files_dir / 'file_0.txt'
+        src.write_bytes(os.urandom(100000))
+        os.chmod(src, 0o640)
+        os.utime(src, ns = (1000000000, 2000000000))
+        original_strategies = take_over.COPY_STRATEGIES
+        try:
+            for strategies in [original_strategies, list()]:
+                take_over.COPY_STRATEGIES = strategies
+                dest = self.files_dir / 'copy.txt'
+                strategy = take_over.fast_copy(str(src), str(dest))
+                if len(strategies) == 0:
+                    self.assertEqual(strategy, 'copy')
+                self.assertIn(strategy, ['reflink', 'copy_file_range', 'sendfile', 'copy'])
+                self.assertEqual(dest.read_bytes(), src.read_bytes())
+                self.assertEqual(dest.stat().st_mode, src.stat().st_mode)
+                self.assertEqual(dest.stat().st_mtime_ns, 2000000000)
+                dest.unlink()
+        finally:
+            take_over.COPY_STRATEGIES = original_strategies
+
+
+    def test_short_copy(self):
+        '''a kernel copy that stops early falls back to the next strategy'''
+        if not hasattr(os, 'copy_file_range'):
+            self.skipTest('copy_file_range is not available')
+        src = self.files_dir / 'file_0.txt'
+        src.write_bytes(os.urandom(5000))
+        dest = self.files_dir / 'copy.txt'
+        copy_file_range = os.copy_file_range
+        os.copy_file_range = lambda src_fd, dest_fd, count: copy_file_range(src_fd, dest_fd, min(count, 1000)) if os.fstat(dest_fd).st_size < 1000 else 0
+        original_strategies = take_over.COPY_STRATEGIES
+        try:
+            take_over.COPY_STRATEGIES = [s for s in original_strategies if s[0] != 'reflink']
+            self.assertNotEqual(take_over.fast_copy(str(src), str(dest)), 'copy_file_range')
+        finally:
+            os.copy_file_range = copy_file_range
+            take_over.COPY_STRATEGIES = original_strategies
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+
+class Test_path_filter(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def test_patterns(self):
+        '''name patterns match at any depth, path patterns match from the root, and excluded directories are pruned'''
+        patterns = take_over.path_filter(['*.txt'], ['files_1/', 'files_2/file_20.txt', 'file_33.*'])
+        self.assertTrue(patterns.dir_excluded('files_1'))
+        self.assertFalse(patterns.dir_excluded('files_3'))
+        self.assertFalse(patterns.file_included('files_2/file_20.txt'))
+        self.assertFalse(patterns.file_included('files_3/file_33.txt'))
+        self.assertTrue(patterns.file_included('files_3/file_34.txt'))
+        self.assertFalse(patterns.file_included('files_3/file_34.xml'))
+
+        visited = list()
+        original_scandir = os.scandir
+        take_over.os.scandir = lambda path: visited.append(os.path.basename(path)) or original_scandir(path)
+        try:
+            files = list(take_over.walk_files(self.files_dir, None, patterns))
+        finally:
+            take_over.os.scandir = original_scandir
+        self.assertNotIn('files_1', visited)
+        self.assertEqual(len(files), len(self.setup_created_files) - self.FILES_NUM - 2)
+
+
+    def test_ignore_file_stored_in_entry(self):
+        '''patterns of the ignore file are stored with the item, and used again by update'''
+        with open(self.files_dir / take_over.path_filter.IGNORE_FILE, 'w') as f:
+            f.write('# comment\nfiles_1\n.takeoverignore\n')
+        self.takeover_args.exclude = ['files_2/']
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        item = list(take_over.sources_db().all_items())[0]
+        self.assertEqual(item._db_entry_data['exclude'], ['files_2/', 'files_1', '.takeoverignore'])
+        self.assertIsNone(item._db_entry_data['include'])
+        for d in ['files_1', 'files_2']:
+            self.assertFalse(any([f.is_symlink() for f in (self.files_dir / d).iterdir()]))
+        self.assertTrue((self.files_dir / 'files_3' / 'file_30.txt').is_symlink())
+
+        (self.files_dir / 'files_1' / 'new.txt').touch()
+        (self.files_dir / 'files_3' / 'new.txt').touch()
+        item.update()
+        self.assertFalse((self.files_dir / 'files_1' / 'new.txt').is_symlink())
+        self.assertTrue((self.files_dir / 'files_3' / 'new.txt').is_symlink())
+
+
+    def test_anchored_patterns(self):
+        '''a pattern starting with '/' matches from the root only'''
+        patterns = take_over.path_filter(None, ['/build', '/files_1/'])
+        self.assertTrue(patterns.dir_excluded('build'))
+        self.assertFalse(patterns.dir_excluded('sub/build'))
+        self.assertFalse(patterns.file_included('build'))
+        self.assertTrue(patterns.file_included('sub/build'))
+        self.assertTrue(patterns.dir_excluded('files_1'))
+        self.assertFalse(patterns.dir_excluded('files_2/files_1'))
+
+
+class Test_directory_links(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        setattr(self.takeover_args, 'dir_links', True)
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'target', None)
+        setattr(self.args, 'dryrun', False)
+        setattr(self.args, 'force', True)
+        setattr(self.args, 'remove', False)
+        take_over.init(None)
+
+
+    def test_single_link(self):
+        '''a directory holding only taken over files is replaced by a single link'''
+        take_over.take_over(self.takeover_args)
+        self.assertTrue(self.files_dir.is_symlink())
+        for f in self.setup_created_files:
+            self.assertTrue(f.exists())
+            self.assertFalse(f.is_symlink())
+        self.args.jobs = 1
+        self.assertEqual(list(take_over.status(self.args).values())[0]['ok'], 1)
+
+        self.files_dir.unlink()
+        summary = take_over.set_links(self.args)
+        self.assertEqual(list(summary.values())[0]['created'], 1)
+        self.assertTrue(self.files_dir.is_symlink())
+
+        take_over.restore_source(self.args)
+        self.assertFalse(self.files_dir.is_symlink())
+        for f in self.setup_created_files:
+            self.assertTrue(f.exists())
+            self.assertFalse(f.is_symlink())
+
+
+    def test_unmanaged_files(self):
+        '''directories holding files that are not taken over get a link for every file and sub directory'''
+        unmanaged = self.files_dir / 'files_1' / 'unmanaged'
+        unmanaged.symlink_to(self.cwd)
+        take_over.take_over(self.takeover_args)
+        self.assertFalse(self.files_dir.is_symlink())
+        self.assertFalse((self.files_dir / 'files_1').is_symlink())
+        self.assertTrue((self.files_dir / 'files_2').is_symlink())
+        self.assertTrue((self.files_dir / 'file_0.txt').is_symlink())
+        self.assertTrue((self.files_dir / 'files_1' / 'file_10.txt').is_symlink())
+        self.assertTrue(unmanaged.is_symlink())
+
+        self.args.name = 'files'
+        take_over.remove_source(self.args)
+        self.assertFalse((self.files_dir / 'files_2').exists())
+        self.assertFalse((self.files_dir / 'files_1' / 'file_10.txt').exists())
+        self.assertTrue(unmanaged.is_symlink())
+        self.assertEqual([i for i in self.db_dir.iterdir() if i.is_dir()], [])
+
+
+class Test_relative_links(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def test_relocation(self):
+        '''relative links keep working when the database and the links are moved together'''
+        self.takeover_args.relative = True
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        for f in self.setup_created_files:
+            self.assertFalse(os.path.isabs(os.readlink(f)))
+            self.assertTrue(f.resolve().exists())
+        args = Cargs()
+        for name, value in [('name', None), ('target', None), ('dryrun', False), ('force', False), ('reconcile', True)]:
+            setattr(args, name, value)
+        summary = take_over.set_links(args)
+        self.assertEqual(list(summary.values())[0]['unchanged'], len(self.setup_created_files))
+
+        moved = self.cwd.parent / (self.cwd.name + '_moved')
+        shutil.rmtree(moved, ignore_errors = True)
+        os.chdir(self.cwd.parent)
+        os.rename(self.cwd, moved)
+        try:
+            for f in self.setup_created_files:
+                self.assertTrue((moved / f.relative_to(self.cwd)).resolve().exists())
+        finally:
+            os.chdir(self.cwd.parent)
+            os.rename(moved, self.cwd)
+
+
 class Test_set_links(BaseTestCase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -300,6 +608,90 @@ class Test_set_links(BaseTestCase):
                 self.assertTrue(i.is_symlink())
 
     
+    def test_rescan(self):
+        '''links are created from the stored files list, files added to the database are linked only after a rescan'''
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        item_dir = [i for i in self.db_dir.iterdir() if i.is_dir()][0]
+        (item_dir / 'added.txt').write_text('added')
+        link = self.files_dir / 'added.txt'
+
+        take_over.set_links(self.args)
+        self.assertFalse(link.is_symlink())
+
+        self.args.rescan = True
+        take_over.set_links(self.args)
+        self.assertTrue(link.is_symlink())
+        self.assertEqual(link.read_text(), 'added')
+
+
+    def test_name_pattern(self):
+        '''test that links are created for all items matching a name prefix or a glob pattern'''
+        items = [self.files_dir / 'files_1', self.files_dir / 'files_2', self.files_dir / 'files_3']
+        take_over.init(None)
+        for item in items:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+            shutil.rmtree(item)
+
+        self.args.name = 'files_[12]'
+        take_over.set_links(self.args)
+        self.assertTrue(items[0].exists())
+        self.assertTrue(items[1].exists())
+        self.assertFalse(items[2].exists())
+
+        self.args.name = 'fil*'
+        take_over.set_links(self.args)
+        for item in items:
+            self.assertEqual(len([i for i in item.iterdir() if i.is_symlink()]), self.FILES_NUM)
+
+
+    def test_parallel_summary(self):
+        '''items are linked in parallel, and every item reports its created, skipped and failed links'''
+        items = [self.files_dir / 'files_{}'.format(d) for d in range(self.DIRS_NUM)]
+        take_over.init(None)
+        for item in items:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+            shutil.rmtree(item)
+        # one existing file is not replaced without force
+        items[0].mkdir()
+        (items[0] / 'file_00.txt').touch()
+
+        self.args.jobs = 4
+        summary = take_over.set_links(self.args)
+        self.assertEqual(len(summary), self.DIRS_NUM)
+        self.assertEqual(sum([s['created'] for s in summary.values()]), self.DIRS_NUM * self.FILES_NUM - 1)
+        self.assertEqual(sum([s['skipped'] for s in summary.values()]), 1)
+        self.assertEqual(sum([s['failed'] for s in summary.values()]), 0)
+        for item in items[1:]:
+            self.assertEqual(len([i for i in item.iterdir() if i.is_symlink()]), self.FILES_NUM)
+
+
+    def test_reconcile(self):
+        '''correct links are not recreated, missing and wrong links are fixed'''
+        item = self.files_dir / 'files_1'
+        take_over.init(None)
+        self.takeover_args.path = str(item)
+        take_over.take_over(self.takeover_args)
+        links = sorted(item.iterdir())
+        inodes = {l : os.lstat(l).st_ino for l in links}
+        links[0].unlink()
+        links[1].unlink()
+        links[1].symlink_to(self.files_dir / 'file_0.txt')
+
+        self.args.reconcile = True
+        summary = take_over.set_links(self.args)
+        result = list(summary.values())[0]
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['unchanged'], self.FILES_NUM - 2)
+        for l in links[2:]:
+            self.assertEqual(os.lstat(l).st_ino, inodes[l])
+        for l in links:
+            self.assertTrue(l.is_symlink())
+            self.assertEqual(l.resolve().name, l.name)
+
+
     def test_duplicate_partial_name(self):
         '''test that links are created when given a partial item name that exists more than once in database'''
         item = self.files_dir / 'files_1'
@@ -395,6 +787,51 @@ class Test_restore_source(BaseTestCase):
                 self.assertFalse(f.is_symlink())
 
 
+    def test_parallel_restore(self):
+        ''' test that all files are restored when using several copy jobs'''
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        self.args.force = True
+        self.args.jobs = 4
+        take_over.restore_source(self.args)
+        file_count = 0
+        for root, dirs, files in os.walk(self.files_dir):
+            for f in [pathlib.Path(root) / file for file in files]:
+                self.assertIn(f, self.setup_created_files)
+                self.assertFalse(f.is_symlink())
+                file_count += 1
+        self.assertEqual(file_count, self.FILES_NUM * (self.DIRS_NUM + 1))
+
+
+    def test_single_file_item_restored(self):
+        ''' test that an item created from a single file is restored'''
+        file = self.files_dir / 'file_1.txt'
+        self.takeover_args.path = str(file)
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        self.assertTrue(file.is_symlink())
+        self.args.force = True
+        take_over.restore_source(self.args)
+        self.assertFalse(file.is_symlink())
+        self.assertTrue(file.is_file())
+
+
+    def test_deleted_directory_restored(self):
+        ''' test that a directory item is restored after its original directory was deleted'''
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        shutil.rmtree(self.files_dir)
+        self.args.force = True
+        take_over.restore_source(self.args)
+        file_count = 0
+        for root, dirs, files in os.walk(self.files_dir):
+            for f in [pathlib.Path(root) / file for file in files]:
+                self.assertIn(f, self.setup_created_files)
+                self.assertFalse(f.is_symlink())
+                file_count += 1
+        self.assertEqual(file_count, self.FILES_NUM * (self.DIRS_NUM + 1))
+
+
     def test_dryrun(self):
         ''' test nothing is retored on dryrun'''
         self.args.force = True
@@ -434,6 +871,868 @@ class Test_restore_source(BaseTestCase):
 
 
 
+class Test_update(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        setattr(self.args, 'name', 'files')
+        setattr(self.args, 'extensions', None)
+        setattr(self.args, 'dryrun', False)
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+
+
+    def get_manifest(self):
+        manifests = list(self.db_dir.glob('*.manifest.json'))
+        self.assertEqual(len(manifests), 1)
+        with open(manifests[0], 'r') as f:
+            return json.load(f)['files']
+
+
+    def test_manifest_created(self):
+        '''takeover records every stored file in the item manifest'''
+        manifest = self.get_manifest()
+        self.assertEqual(len(manifest), self.FILES_NUM * (self.DIRS_NUM + 1))
+        self.assertIn('files_1/file_10.txt', manifest)
+
+
+    def test_new_files(self):
+        '''only new files are taken over, existing links are left untouched'''
+        link_inodes = {f : os.lstat(str(f)).st_ino for f in self.setup_created_files}
+        new_files = [self.files_dir / 'new.txt', self.files_dir / 'files_3' / 'new.txt']
+        for f in new_files:
+            f.write_text('new')
+        take_over.update(self.args)
+        for f in new_files:
+            self.assertTrue(f.is_symlink())
+            self.assertEqual(f.read_text(), 'new')
+        for f, inode in link_inodes.items():
+            self.assertEqual(os.lstat(str(f)).st_ino, inode)
+        self.assertIn('files_3/new.txt', self.get_manifest())
+
+
+    def test_changed_file(self):
+        '''a real file that replaced a link is taken over again'''
+        f = self.files_dir / 'files_2' / 'file_21.txt'
+        f.unlink()
+        f.write_text('changed')
+        take_over.update(self.args)
+        self.assertTrue(f.is_symlink())
+        self.assertEqual(f.read_text(), 'changed')
+        self.assertEqual(self.get_manifest()['files_2/file_21.txt'][0], len('changed'))
+
+
+    def test_dryrun(self):
+        '''nothing is taken over on dryrun'''
+        new_file = self.files_dir / 'new.txt'
+        new_file.write_text('new')
+        self.args.dryrun = True
+        take_over.update(self.args)
+        self.assertFalse(new_file.is_symlink())
+        self.assertNotIn('new.txt', self.get_manifest())
+
+
+class Test_watch(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        self.takeover_args.extensions = ['txt']
+        take_over.take_over(self.takeover_args)
+
+
+    def watch_new_files(self, use_inotify):
+        items = list(take_over.sources_db().all_items())
+        watcher = take_over.source_watcher(items, 0.1, 0.1, use_inotify)
+        stop = threading.Event()
+        thread = threading.Thread(target = watcher.run, args = (stop,))
+        thread.start()
+        try:
+            new_dir = self.files_dir / 'files_1' / 'new'
+            new_dir.mkdir()
+            new_files = [self.files_dir / 'new.txt', new_dir / 'new.txt']
+            for f in new_files:
+                f.write_text('new')
+            (self.files_dir / 'new.xml').write_text('not taken over')
+            for i in range(100):
+                if all([f.is_symlink() for f in new_files]):
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        for f in new_files:
+            self.assertTrue(f.is_symlink())
+            self.assertEqual(f.read_text(), 'new')
+        self.assertFalse((self.files_dir / 'new.xml').is_symlink())
+        manifest = items[0].get_manifest()
+        manifest.load()
+        self.assertIn('files_1/new/new.txt', manifest.files)
+
+
+    def test_inotify(self):
+        '''new files are taken over as they appear, including files in new directories'''
+        try:
+            take_over.inotify_watcher().close()
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+        self.watch_new_files(True)
+
+
+    def test_slow_writer(self):
+        '''a file is taken over only after its writer closed it, even if writing pauses for longer than the debounce time'''
+        try:
+            take_over.inotify_watcher().close()
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+        items = list(take_over.sources_db().all_items())
+        watcher = take_over.source_watcher(items, 0.1, 0.1, True)
+        stop = threading.Event()
+        thread = threading.Thread(target = watcher.run, args = (stop,))
+        thread.start()
+        new_file = self.files_dir / 'slow.txt'
+        try:
+            with open(new_file, 'w') as f:
+                f.write('part1\n')
+                f.flush()
+                time.sleep(0.5)
+                self.assertFalse(new_file.is_symlink())
+                f.write('part2\n')
+            for i in range(100):
+                if new_file.is_symlink():
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertTrue(new_file.is_symlink())
+        self.assertEqual(new_file.read_text(), 'part1\npart2\n')
+
+
+    def test_nested_items(self):
+        '''events go to the item that owns the path, also when a file item is in a parent directory of another item'''
+        etc = self.cwd / 'etc'
+        (etc / 'nginx').mkdir(parents = True)
+        (etc / 'hosts.txt').write_text('hosts')
+        (etc / 'nginx' / 'nginx.txt').write_text('conf')
+        for path in [etc / 'hosts.txt', etc / 'nginx']:
+            self.takeover_args.path = str(path)
+            take_over.take_over(self.takeover_args)
+        db = take_over.sources_db()
+        hosts = db.find_item('hosts.txt')
+        nginx = db.find_item('nginx')
+        watcher = take_over.source_watcher([hosts, nginx, db.find_item('files')], use_inotify = False)
+        new_file = etc / 'nginx' / 'new.txt'
+        new_file.write_text('new')
+        item = watcher._item_for(str(new_file))
+        self.assertEqual(item.get_id(), nginx.get_id())
+        self.assertEqual(len(item.records_for([str(new_file)])), 1)
+        self.assertEqual(watcher._item_for(str(etc / 'hosts.txt')).get_id(), hosts.get_id())
+        self.assertIsNone(watcher._item_for(str(etc / 'other.txt')))
+        self.assertEqual(watcher._item_for(str(self.files_dir / 'files_1' / 'new.txt')).get_id(), db.find_item('files').get_id())
+
+
+    def test_polling(self):
+        '''new files are found by scanning when inotify is not used'''
+        self.watch_new_files(False)
+
+
+class Test_list(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        (self.files_dir / 'file_0.txt').write_text('content')
+        take_over.take_over(self.takeover_args)
+        setattr(self.args, 'verbose', False)
+        setattr(self.args, 'very_verbose', True)
+        setattr(self.args, 'format', 'jsonl')
+
+
+    def list_output(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            take_over.list_sources(self.args)
+        return output.getvalue()
+
+
+    def test_stats(self):
+        '''very verbose listing shows the cached statistics, and link health after a status check'''
+        records = [json.loads(l) for l in self.list_output().splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['name'], 'files')
+        self.assertEqual(records[0]['files'], len(self.setup_created_files))
+        self.assertEqual(records[0]['bytes'], len('content'))
+        self.assertEqual(records[0]['link health'], 'unknown')
+        self.assertIsNotNone(records[0]['last ingest'])
+
+        (self.files_dir / 'file_1.txt').unlink()
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'jobs', 1)
+        db_stat = os.stat(self.db_file_name)
+        take_over.status(self.args)
+        # checking links doesnt write the database
+        self.assertEqual(os.stat(self.db_file_name).st_mtime_ns, db_stat.st_mtime_ns)
+        self.assertEqual(os.stat(self.db_file_name).st_ino, db_stat.st_ino)
+        record = json.loads(self.list_output())
+        self.assertEqual(record['link health'], 'drifted')
+        self.assertEqual(record['links drifted'], 1)
+        self.assertEqual(record['links ok'], len(self.setup_created_files) - 1)
+
+
+    def test_formats(self):
+        '''json is a valid list, and csv has a header line'''
+        self.args.format = 'json'
+        records = json.loads(self.list_output())
+        self.assertEqual(records[0]['database id'], list(take_over.sources_db().all_items())[0].get_id())
+        self.args.format = 'csv'
+        self.args.very_verbose = False
+        lines = self.list_output().splitlines()
+        self.assertEqual(lines, ['name', 'files'])
+
+
+class Test_serve(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        # commands are forwarded only when the server is not disabled in the environment running the tests
+        environ = unittest.mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop('TAKEOVER_NO_SERVER', None)
+        take_over.init(None)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target = take_over.resident_server(self.db_dir).serve_forever, args = (self.stop,))
+        self.thread.start()
+        for i in range(100):
+            if (self.db_dir / take_over.resident_server.SOCKET_NAME).exists():
+                break
+            time.sleep(0.05)
+
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+        super().tearDown()
+
+
+    def test_forward(self):
+        '''commands are answered by the server, and its database follows the changes made without it'''
+        self.assertEqual(take_over.resident_server.forward(['takeover', str(self.files_dir), '-e', 'txt']), 0)
+        for f in self.setup_created_files:
+            self.assertTrue(f.is_symlink())
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 1)
+
+        # a local command that changes the database file is seen by the next forwarded command
+        other_dir = self.cwd / 'other'
+        other_dir.mkdir()
+        (other_dir / 'other.txt').touch()
+        env = dict(os.environ, TAKEOVER_NO_SERVER = '1')
+        subprocess.run([sys.executable, take_over.__file__, 'takeover', str(other_dir)], env = env, check = True, capture_output = True)
+        report = self.db_dir / 'report.json'
+        self.assertEqual(take_over.resident_server.forward(['status', '--report', str(report)]), 0)
+        self.assertEqual(len(json.loads(report.read_text())), 2)
+
+
+    def test_local_commands(self):
+        '''commands that must run in the calling process are not sent'''
+        self.assertIsNone(take_over.resident_server.forward(['init']))
+        self.assertIsNone(take_over.resident_server.forward(['takeover', '--from-file', '-']))
+
+
+class Test_dedup(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        setattr(self.takeover_args, 'dedup', True)
+        setattr(self.args, 'dryrun', False)
+        for d in range(self.DIRS_NUM):
+            for f in range(self.FILES_NUM):
+                (self.files_dir / 'files_{}'.format(d) / 'file_{}{}.txt'.format(d, f)).write_text('content {}'.format(f))
+
+
+    def blobs(self):
+        return [pathlib.Path(root) / f for root, dirs, files in os.walk(self.db_dir / 'blobs') for f in files]
+
+
+    def test_identical_files_stored_once(self):
+        '''identical files of several items share a single blob'''
+        items = [self.files_dir / 'files_1', self.files_dir / 'files_2']
+        take_over.init(None)
+        for item in items:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+        self.assertEqual(len(self.blobs()), self.FILES_NUM)
+        for f in range(self.FILES_NUM):
+            first = (items[0] / 'file_1{}.txt'.format(f)).resolve()
+            second = (items[1] / 'file_2{}.txt'.format(f)).resolve()
+            self.assertTrue(first.samefile(second))
+            self.assertEqual(first.read_text(), 'content {}'.format(f))
+
+
+    def test_blobs_released_on_remove(self):
+        '''blobs are removed only when the last item using them is removed'''
+        items = [self.files_dir / 'files_1', self.files_dir / 'files_2']
+        take_over.init(None)
+        for item in items:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+
+        self.args.name = 'files_1'
+        take_over.remove_source(self.args)
+        self.assertEqual(len(self.blobs()), self.FILES_NUM)
+        for i in items[1].iterdir():
+            self.assertTrue(i.resolve().exists())
+
+        self.args.name = 'files_2'
+        take_over.remove_source(self.args)
+        self.assertEqual(len(self.blobs()), 0)
+
+
+    def test_release_without_scanning_blobs(self):
+        '''the blobs of a removed item are found from its manifest, the blobs folder is not listed'''
+        self.takeover_args.path = str(self.files_dir / 'files_1')
+        take_over.init(None)
+        take_over.take_over(self.takeover_args)
+        scanned = list()
+        scandir = os.scandir
+        def recording_scandir(path = '.'):
+            scanned.append(str(path))
+            return scandir(path)
+        os.scandir = recording_scandir
+        try:
+            self.args.name = 'files_1'
+            take_over.remove_source(self.args)
+        finally:
+            os.scandir = scandir
+        self.assertEqual(len(self.blobs()), 0)
+        self.assertEqual([p for p in scanned if p.startswith(str(self.db_dir / 'blobs'))], [])
+
+
+    def test_edited_blob_not_reused(self):
+        '''a file edited through its link doesnt replace the content of identical files taken over later'''
+        items = [self.files_dir / 'files_1', self.files_dir / 'files_2']
+        (items[0] / 'app.conf').write_text('original')
+        (items[1] / 'app.conf').write_text('original')
+        take_over.init(None)
+        self.takeover_args.path = str(items[0])
+        take_over.take_over(self.takeover_args)
+        (items[0] / 'app.conf').write_text('edited')
+        self.takeover_args.path = str(items[1])
+        take_over.take_over(self.takeover_args)
+        self.assertEqual((items[0] / 'app.conf').read_text(), 'edited')
+        self.assertEqual((items[1] / 'app.conf').read_text(), 'original')
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'jobs', 1)
+        setattr(self.args, 'changed', False)
+        setattr(self.args, 'since', None)
+        files_2 = take_over.sources_db().find_item('files_2').get_id()
+        self.assertEqual([p for p in take_over.verify(self.args) if p['database id'] == files_2], [])
+
+        # the edited blob is released with the item using it
+        self.args.name = 'files_1'
+        take_over.remove_source(self.args)
+        self.args.name = 'files_2'
+        take_over.remove_source(self.args)
+        self.assertEqual(len(self.blobs()), 0)
+
+
+class Test_batch(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        for d in range(3):
+            self.takeover_args.path = str(self.files_dir / 'files_{}'.format(d))
+            take_over.take_over(self.takeover_args)
+
+
+    def test_single_save(self):
+        '''changes in a batch are written once'''
+        db = take_over.sources_db()
+        saves = list()
+        original_save = db._backend.save
+        db._backend.save = lambda: saves.append(1) or original_save()
+        with db.batch():
+            for i in list(db.all_items()):
+                db.remove_item(i.get_id(), False)
+        self.assertEqual(len(saves), 1)
+        with open(self.db_file_name, 'r') as f:
+            self.assertDictEqual(json.load(f), dict())
+        self.assertEqual([i for i in self.db_dir.iterdir() if i.is_dir()], [])
+
+
+    def test_rollback(self):
+        '''a failed batch leaves the database and the storage untouched'''
+        with open(self.db_file_name, 'r') as f:
+            entries = json.load(f)
+        db = take_over.sources_db()
+        with self.assertRaises(ValueError):
+            with db.batch():
+                db.remove_item('files_0', False)
+                db.remove_item('files_1', False)
+                raise ValueError()
+        self.assertEqual(len(list(db.all_items())), 3)
+        with open(self.db_file_name, 'r') as f:
+            self.assertDictEqual(json.load(f), entries)
+        for id in entries:
+            self.assertTrue((self.db_dir / id).exists())
+
+
+    def test_failed_save_rolls_back(self):
+        '''when the batch changes cant be written, the removed entries are restored in memory'''
+        db = take_over.sources_db()
+        ids = [i.get_id() for i in db.all_items()]
+        db._backend.save = lambda: False
+        with db.batch():
+            db.remove_item('files_0', False)
+        self.assertEqual(sorted([i.get_id() for i in db.all_items()]), sorted(ids))
+        self.assertIsNotNone(db.find_item('files_0'))
+        for id in ids:
+            self.assertTrue((self.db_dir / id).exists())
+
+
+class Test_sqlite_backend(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'target', None)
+        setattr(self.args, 'dryrun', False)
+        setattr(self.args, 'force', False)
+        self.items = [self.files_dir / 'files_1', self.files_dir / 'files_2']
+
+
+    def take_over_items(self):
+        for item in self.items:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+
+
+    def test_sqlite_database(self):
+        '''items are stored in sqlite, and can be found, linked and removed'''
+        self.args.backend = 'sqlite'
+        take_over.init(self.args)
+        self.take_over_items()
+        self.assertTrue((self.db_dir / 'takeover_db.sqlite').exists())
+        self.assertFalse((self.db_dir / self.db_file_name).exists())
+
+        db = take_over.sources_db()
+        self.assertEqual(len(list(db.all_items())), 2)
+        self.assertEqual(len(db.find_items('files_*')), 2)
+        self.assertIsNotNone(db.find_item('files_1'))
+
+        self.args.name = 'files_1'
+        take_over.remove_source(self.args)
+        db = take_over.sources_db()
+        self.assertIsNone(db.find_item('files_1'))
+        self.assertEqual(len(list(db.all_items())), 1)
+
+
+    def test_streamed_entries(self):
+        '''entries are read from a cursor in chunks, and the database can be changed while they are read'''
+        self.args.backend = 'sqlite'
+        take_over.init(self.args)
+        self.take_over_items()
+        backend = take_over.open_backend(self.db_dir, 'sqlite')
+        backend.load()
+        backend.fetch_size = 1
+        entries = backend.entries()
+        first = next(entries)
+        backend.put(dict(first, stats = {'files' : 1}))
+        self.assertEqual([first['database id']] + [e['database id'] for e in entries], sorted([e['database id'] for e in backend.entries()]))
+
+
+    def test_migrate(self):
+        '''a json database is migrated to sqlite in one go'''
+        take_over.init(None)
+        self.take_over_items()
+        with open(self.db_file_name, 'r') as f:
+            entries = json.load(f)
+
+        self.args.to = 'sqlite'
+        take_over.migrate(self.args)
+        self.assertFalse((self.db_dir / self.db_file_name).exists())
+        db = take_over.sources_db()
+        for id, entry in entries.items():
+            self.assertDictEqual(db.find_item(id)._db_entry_data, entry)
+
+        for item in self.items:
+            shutil.rmtree(item)
+        take_over.set_links(self.args)
+        for item in self.items:
+            self.assertEqual(len([i for i in item.iterdir() if i.is_symlink()]), self.FILES_NUM)
+
+
+class Test_sharded_backend(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'target', None)
+        setattr(self.args, 'dryrun', False)
+        setattr(self.args, 'force', False)
+        self.args.backend = 'sharded'
+        take_over.init(self.args)
+        for item in [self.files_dir / 'files_1', self.files_dir / 'files_2']:
+            self.takeover_args.path = str(item)
+            take_over.take_over(self.takeover_args)
+
+
+    def test_sharded_database(self):
+        '''every entry has its own file, and only the names are in the index'''
+        with open(self.db_dir / 'takeover_index.json', 'r') as f:
+            index = json.load(f)
+        self.assertEqual(sorted(index.values()), ['files_1', 'files_2'])
+        for id in index:
+            with open(self.db_dir / (id + '.entry.json'), 'r') as f:
+                self.assertEqual(json.load(f)['database id'], id)
+        self.assertFalse((self.db_dir / self.db_file_name).exists())
+
+        db = take_over.sources_db()
+        self.assertEqual(len(db.find_items('files_*')), 2)
+        self.args.name = 'files_1'
+        take_over.remove_source(self.args)
+        db = take_over.sources_db()
+        self.assertIsNone(db.find_item('files_1'))
+        self.assertEqual(len(list(db.all_items())), 1)
+        self.assertEqual(len(list(self.db_dir.glob('*.entry.json'))), 1)
+
+
+    def test_single_item(self):
+        '''finding an item reads its entry only, and writers to different items keep each other changes'''
+        db = take_over.sources_db()
+        item = db.find_item('files_1')
+        self.assertEqual(list(db._backend._entries), [item.get_id()])
+
+        other = take_over.sources_db()
+        other_item = other.find_item('files_2')
+        item.load_manifest().files['new.txt'] = [1, 0, 0, '']
+        other_item.load_manifest().files['new.txt'] = [2, 0, 0, '']
+        self.assertTrue(db.record_stats(item))
+        self.assertTrue(other.record_stats(other_item))
+        # a new item added by a third writer is kept in the index too
+        self.takeover_args.path = str(self.files_dir / 'files_3')
+        take_over.take_over(self.takeover_args)
+        with db.batch():
+            db.remove_item(item.get_id(), False)
+
+        db = take_over.sources_db()
+        self.assertEqual(sorted([i.get_id().split('_', maxsplit = 1)[1] for i in db.all_items()]), ['files_2', 'files_3'])
+        self.assertEqual(db.find_item('files_2').stats()['bytes'], 2)
+
+
+    def test_failed_write_rolls_back(self):
+        '''when the index cant be written, the batch changes are rolled back in memory'''
+        db = take_over.sources_db()
+        db._backend._write_index = lambda added, removed: False
+        with db.batch():
+            db.remove_item('files_1', False)
+        self.assertIsNotNone(db.find_item('files_1'))
+        self.assertEqual(len(list(db.all_items())), 2)
+        self.assertEqual(len(db.find_items('files_*')), 2)
+
+
+    def test_migrate(self):
+        '''a sharded database is migrated to json with all its entries'''
+        entries = {i.get_id() : i._db_entry_data for i in take_over.sources_db().all_items()}
+        self.args.to = 'json'
+        take_over.migrate(self.args)
+        with open(self.db_file_name, 'r') as f:
+            self.assertDictEqual(json.load(f), entries)
+
+
+class Test_plan(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        self.plan_file = self.cwd / 'plan.json'
+        setattr(self.args, 'plan_file', str(self.plan_file))
+        setattr(self.args, 'dryrun', False)
+        setattr(self.args, 'jobs', 4)
+
+
+    def test_save_and_apply(self):
+        '''a saved takeover plan changes nothing until it is applied'''
+        self.takeover_args.plan = str(self.plan_file)
+        take_over.take_over(self.takeover_args)
+        self.assertTrue(self.plan_file.exists())
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 0)
+        for f in self.setup_created_files:
+            self.assertFalse(f.is_symlink())
+
+        take_over.apply_plan(self.args)
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 1)
+        for f in self.setup_created_files:
+            self.assertTrue(f.is_symlink())
+            self.assertTrue(f.resolve().exists())
+
+
+    def test_copy_wrapper(self):
+        '''copy_original_files_to_db executes the ingest plan of the item, leaving the original files in place'''
+        entry = {'name' : 'files', 'database id' : '1_files', 'is file' : False, 'original path' : str(self.files_dir),
+            'default database path' : str(self.db_dir), 'symlink path' : str(self.files_dir), 'extensions' : None}
+        item = take_over.db_item(entry, self.db_dir)
+        self.assertTrue(item.copy_original_files_to_db(False, 4))
+        for f in self.setup_created_files:
+            self.assertTrue((item.get_db_path() / f.relative_to(self.files_dir)).exists())
+            self.assertFalse(f.is_symlink())
+
+
+    def test_plan_operations(self):
+        '''links are planned as unlink and symlink operations, grouped by kind'''
+        plan = take_over.operation_plan(take_over.operation_plan.TAKEOVER)
+        db = take_over.sources_db()
+        item, files = db.plan_add_dir(plan, str(self.files_dir), None)
+        item.plan_takeover_links(plan, files)
+        kinds = [op['op'] for op in plan.operations()]
+        self.assertEqual(kinds.count('copy'), len(self.setup_created_files))
+        self.assertEqual(kinds.count('symlink'), len(self.setup_created_files))
+        self.assertEqual(kinds.count('register'), 1)
+        self.assertLess(kinds.index('register'), kinds.index('unlink'))
+
+        plan.save(str(self.plan_file))
+        loaded = take_over.operation_plan.load(str(self.plan_file))
+        self.assertEqual(loaded.operations(), plan.operations())
+        self.assertEqual(loaded.rollback, plan.rollback)
+
+
+    def test_failed_copy_rolls_back(self):
+        '''when copying fails, the partially stored item is removed and the originals are left in place'''
+        plan = take_over.operation_plan(take_over.operation_plan.TAKEOVER)
+        db = take_over.sources_db()
+        item, files = db.plan_add_dir(plan, str(self.files_dir), None)
+        item.plan_takeover_links(plan, files)
+        plan.add('copy', src = str(self.files_dir / 'missing.txt'), dest = str(item.get_db_path()), store = None)
+        self.assertFalse(take_over.plan_executor(db).execute(plan))
+        self.assertFalse(item.get_db_path().exists())
+        self.assertEqual(len(list(db.all_items())), 0)
+        for f in self.setup_created_files:
+            self.assertFalse(f.is_symlink())
+
+
+class Test_verify(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        self.takeover_args.path = str(self.files_dir / 'files_1')
+        take_over.take_over(self.takeover_args)
+        self.item = list(take_over.sources_db().all_items())[0]
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'jobs', 4)
+
+
+    def test_problems(self):
+        '''modified, missing and unrecorded files are reported'''
+        self.assertEqual(take_over.verify(self.args), [])
+        db_path = self.item.get_db_path()
+        (db_path / 'file_11.txt').write_text('edited')
+        (db_path / 'file_12.txt').unlink()
+        (db_path / 'extra.txt').touch()
+        report = take_over.verify(self.args)
+        problems = {r['file'] : r['problem'] for r in report}
+        self.assertEqual(problems, {'file_11.txt' : 'modified', 'file_12.txt' : 'missing', 'extra.txt' : 'unrecorded'})
+
+
+    def test_corrupt_and_changed_only(self):
+        '''content changes that keep the size and modification time are corrupt. changed-only mode hashes changed files only'''
+        db_path = self.item.get_db_path()
+        manifest = self.item.get_manifest()
+        for name, content in [('file_10.txt', b'good'), ('file_11.txt', b'good')]:
+            (db_path / name).write_bytes(content)
+            manifest.load()
+            manifest.add(name, db_path / name)
+            manifest.save()
+        st = (db_path / 'file_10.txt').stat()
+        (db_path / 'file_10.txt').write_bytes(b'evil')
+        os.utime(db_path / 'file_10.txt', ns = (st.st_atime_ns, st.st_mtime_ns))
+        (db_path / 'file_11.txt').write_bytes(b'edited')
+
+        report = take_over.verify(self.args)
+        self.assertEqual({r['file'] : r['problem'] for r in report}, {'file_10.txt' : 'corrupt', 'file_11.txt' : 'modified'})
+        self.args.changed = True
+        report = take_over.verify(self.args)
+        self.assertEqual({r['file'] : r['problem'] for r in report}, {'file_11.txt' : 'modified'})
+
+
+    def test_rescan_without_hashing(self):
+        '''a rescan doesnt read the stored files. unchanged files keep their hash, new files are hashed by verify'''
+        db_path = self.item.get_db_path()
+        old_hashes = {f : record[3] for f, record in self.item.load_manifest().files.items()}
+        (db_path / 'extra.txt').write_text('extra')
+        hashed = list()
+        file_hash = take_over.file_hash
+        take_over.file_hash = lambda path: hashed.append(path)
+        try:
+            manifest = self.item.load_manifest(True)
+        finally:
+            take_over.file_hash = file_hash
+        self.assertEqual(hashed, [])
+        self.assertIsNone(manifest.files['extra.txt'][3])
+        self.assertEqual({f : manifest.files[f][3] for f in old_hashes}, old_hashes)
+        self.assertEqual(take_over.verify(self.args), [])
+        manifest = self.item.get_manifest()
+        manifest.load()
+        self.assertEqual(manifest.files['extra.txt'][3], take_over.file_hash(db_path / 'extra.txt'))
+
+
+class Test_status(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        setattr(self.args, 'name', None)
+        setattr(self.args, 'jobs', 4)
+
+
+    def test_drift(self):
+        '''every kind of drift is reported, and correct links are counted'''
+        take_over.take_over(self.takeover_args)
+        report = take_over.status(self.args)
+        result = list(report.values())[0]
+        self.assertEqual(result['ok'], len(self.setup_created_files))
+
+        item = list(take_over.sources_db().all_items())[0]
+        files_1 = self.files_dir / 'files_1'
+        (files_1 / 'file_10.txt').unlink()
+        (files_1 / 'file_11.txt').unlink()
+        (files_1 / 'file_11.txt').write_text('replaced')
+        (files_1 / 'file_12.txt').unlink()
+        (files_1 / 'file_12.txt').symlink_to(self.files_dir / 'file_0.txt')
+        (item.get_db_path() / 'files_1' / 'file_13.txt').unlink()
+        (files_1 / 'new.txt').touch()
+        (self.files_dir / 'new_dir').mkdir()
+        (self.files_dir / 'new_dir' / 'new.txt').touch()
+        shutil.rmtree(self.files_dir / 'files_2')
+
+        result = list(take_over.status(self.args).values())[0]
+        self.assertEqual(sorted(result['missing']), sorted([str(files_1 / 'file_10.txt')] + [str(f) for f in self.setup_created_files if f.parent.name == 'files_2']))
+        self.assertEqual(result['replaced'], [str(files_1 / 'file_11.txt')])
+        self.assertEqual(result['wrong target'], [str(files_1 / 'file_12.txt')])
+        self.assertEqual(result['dangling'], [str(files_1 / 'file_13.txt')])
+        self.assertEqual(sorted(result['unmanaged']), [str(files_1 / 'new.txt'), str(self.files_dir / 'new_dir' / 'new.txt')])
+        self.assertEqual(result['ok'], len(self.setup_created_files) - 4 - self.FILES_NUM)
+
+
+class Test_resume(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+    def setUp(self):
+        super().setUp()
+        take_over.init(None)
+        setattr(self.args, 'dryrun', False)
+        setattr(self.args, 'jobs', 1)
+
+
+    def interrupted_take_over(self):
+        '''take over files_dir, and crash after the original files were removed, before any link was created'''
+        db = take_over.sources_db()
+        plan = take_over.operation_plan(take_over.operation_plan.TAKEOVER)
+        take_over.plan_take_over(db, str(self.files_dir), self.takeover_args, plan)
+        original_run_symlink = take_over.plan_executor._run_symlink
+        def crash(executor, ops):
+            raise KeyboardInterrupt()
+        take_over.plan_executor._run_symlink = crash
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                take_over.plan_executor(db).execute(plan)
+        finally:
+            take_over.plan_executor._run_symlink = original_run_symlink
+        self.assertEqual(len(take_over.operation_journal.find(self.db_dir)), 1)
+        for f in self.setup_created_files:
+            self.assertFalse(os.path.lexists(f))
+
+
+    def test_resume(self):
+        '''an interrupted take over is completed without copying the files again'''
+        self.interrupted_take_over()
+        copies = list()
+        original_fast_copy = take_over.fast_copy
+        take_over.fast_copy = lambda src, dest: copies.append(src) or original_fast_copy(src, dest)
+        self.args.rollback = False
+        try:
+            take_over.resume(self.args)
+        finally:
+            take_over.fast_copy = original_fast_copy
+        self.assertEqual(copies, [])
+        self.assertEqual(take_over.operation_journal.find(self.db_dir), [])
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 1)
+        for f in self.setup_created_files:
+            self.assertTrue(f.is_symlink())
+            self.assertTrue(f.resolve().exists())
+
+
+    def test_rollback(self):
+        '''an interrupted take over is rolled back: the original files are back, and the item is removed'''
+        self.interrupted_take_over()
+        self.args.rollback = True
+        take_over.resume(self.args)
+        self.assertEqual(take_over.operation_journal.find(self.db_dir), [])
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 0)
+        self.assertEqual([i for i in self.db_dir.iterdir() if i.is_dir()], [])
+        for f in self.setup_created_files:
+            self.assertTrue(f.exists())
+            self.assertFalse(f.is_symlink())
+
+
+    def test_running_not_resumed(self):
+        '''the journal of an execution that is still running is not resumed or rolled back'''
+        self.interrupted_take_over()
+        journal = take_over.operation_journal.find(self.db_dir)[0]
+        self.assertTrue(journal.reopen())
+        self.assertEqual(take_over.operation_journal.find(self.db_dir), [])
+        self.args.rollback = True
+        take_over.resume(self.args)
+        self.assertEqual(len(list(take_over.sources_db().all_items())), 1)
+        for f in self.setup_created_files:
+            self.assertFalse(os.path.lexists(f))
+        journal.close()
+        self.assertEqual(len(take_over.operation_journal.find(self.db_dir)), 1)
+
+
+    def test_no_journal_left(self):
+        '''a completed take over leaves no journal'''
+        take_over.take_over(self.takeover_args)
+        self.assertEqual(take_over.operation_journal.find(self.db_dir), [])
+
+
 class Test_remove_source(BaseTestCase):
 
     def __init__(self, *args, **kwargs):